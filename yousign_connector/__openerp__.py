@@ -4,7 +4,7 @@
 
 {
     'name': 'Yousign Connector',
-    'version': '8.0.2.0.0',
+    'version': '8.0.2.1.0',
     'category': 'Signature',
     'license': 'AGPL-3',
     'summary': 'Odoo generates signature requests on Yousign',
@@ -21,6 +21,8 @@
     'data': [
         'data/yousign_seq.xml',
         'data/cron.xml',
+        'wizard/yousign_request_bulk_view.xml',
+        'wizard/yousign_request_preflight_view.xml',
         'views/yousign_request_template.xml',
         'views/yousign_request.xml',
         'security/ir.model.access.csv',
@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from email.utils import parsedate_tz, mktime_tz
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from . import metrics
+from . import tracing
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    logger.debug('Cannot import requests')
+
+# (connect timeout, read timeout) in seconds, per endpoint class
+DEFAULT_TIMEOUTS = {
+    'status': (5, 30),
+    'default': (10, 60),
+    'upload': (10, 600),
+    'download': (10, 600),
+    }
+DEFAULT_POOL_SIZE = 10
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# One client per (URL, headers) and per Odoo worker process: the
+# requests.Session keeps the TLS connections alive between calls
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class YousignError(Exception):
+    '''Raised by YousignClient.call(). It doesn't depend on the ORM, so
+    it can be raised from a worker thread; the model converts it into a
+    translated UserError (cf yousign_error_message()).
+    kind is 'connection', 'technical' or 'status'.'''
+
+    def __init__(
+            self, kind, method, url, error=None, status_code=None,
+            expected_status_code=None, title=None, detail=None):
+        self.kind = kind
+        self.method = method
+        self.url = url
+        self.error = error
+        self.status_code = status_code
+        self.expected_status_code = expected_status_code
+        self.title = title
+        self.detail = detail
+        if kind == 'status':
+            msg = '%s %s returned HTTP %s (%s was expected): %s (%s)' % (
+                method, url, status_code, expected_status_code, title,
+                detail)
+        else:
+            msg = '%s %s failed: %s' % (method, url, error)
+        super(YousignError, self).__init__(msg)
+
+
+def endpoint_class(method, url):
+    if url.endswith('/download'):
+        return 'download'
+    if method == 'POST' and url == '/files':
+        return 'upload'
+    if method == 'GET':
+        return 'status'
+    return 'default'
+
+
+def endpoint_label(url):
+    '''Label of the endpoint for the metrics: '/procedures', '/files',
+    '/members', '/file_objects', '/files/download'...'''
+    parts = url.strip('/').split('/')
+    label = '/' + parts[0]
+    if len(parts) > 2:
+        label += '/' + parts[-1]
+    return label
+
+
+def observe_call(method, url, status, start, res=None, stream=False):
+    labels = {'method': method, 'endpoint': endpoint_label(url)}
+    metrics.inc(
+        'yousign_api_requests_total', dict(labels, status=str(status)))
+    metrics.observe(
+        'yousign_api_request_duration_seconds', time.time() - start, labels)
+    if res is None:
+        tracing.record_call()
+        return
+    body = res.request.body
+    sent = body is not None and len(body) or 0
+    received = not stream and len(res.content) or 0
+    if body is not None:
+        metrics.inc('yousign_api_request_bytes_total', labels, sent)
+    if not stream:
+        metrics.inc('yousign_api_response_bytes_total', labels, received)
+    tracing.record_call(sent, received)
+
+
+class RetryPolicy(object):
+    '''Retry with jittered exponential backoff. The Retry-After header
+    sent by Yousign with HTTP 429/503 takes precedence over the backoff.
+    Non-idempotent requests (POST) are only retried when we are sure
+    that Yousign didn't process them (connect timeout, HTTP 429), unless
+    retry_non_idempotent is set.'''
+
+    def __init__(
+            self, max_attempts=3, backoff_base=1.0, backoff_max=30.0,
+            retry_statuses=(429, 500, 502, 503, 504), max_retry_after=120,
+            retry_non_idempotent=False):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = frozenset(retry_statuses)
+        self.max_retry_after = max_retry_after
+        self.retry_non_idempotent = retry_non_idempotent
+
+    def allow_method(self, method):
+        return method in IDEMPOTENT_METHODS or self.retry_non_idempotent
+
+    def should_retry_exception(self, method, exc):
+        if isinstance(exc, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(exc, (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout)):
+            return self.allow_method(method)
+        return False
+
+    def should_retry_response(self, method, response):
+        if response.status_code not in self.retry_statuses:
+            return False
+        if response.status_code == 429:
+            return True
+        return self.allow_method(method)
+
+    def parse_retry_after(self, response):
+        value = response is not None and response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        date_tuple = parsedate_tz(value)
+        if date_tuple is None:
+            return None
+        return max(mktime_tz(date_tuple) - time.time(), 0)
+
+    def get_delay(self, attempt, response=None):
+        '''Returns the number of seconds to wait before the next attempt,
+        or None if we should not wait that long'''
+        retry_after = self.parse_retry_after(response)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return retry_after
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+DEFAULT_RETRY = RetryPolicy()
+# the cron is not in a hurry, so it can wait for Yousign to recover
+CRON_RETRY = RetryPolicy(
+    max_attempts=6, backoff_base=2.0, backoff_max=120.0, max_retry_after=300)
+
+
+class FileJSONBody(object):
+    '''File-like JSON body {<values>, "content": "<file in base64>"} that
+    reads the file and encodes it in base64 chunk by chunk, so that the
+    file is never fully loaded in memory. The length of the body is known
+    in advance, so it is sent with a Content-Length header.'''
+    # multiple of 3, so that the base64 chunks can be concatenated
+    CHUNK_SIZE = 3 * 16 * 1024
+
+    def __init__(self, path, values, content_key='content'):
+        self.path = path
+        values_json = json.dumps(values)
+        assert values_json.endswith('}') and len(values) > 0
+        self.prefix = '%s, %s: "' % (values_json[:-1], json.dumps(content_key))
+        self.suffix = '"}'
+        file_size = os.path.getsize(path)
+        self.length = (
+            len(self.prefix) + 4 * ((file_size + 2) // 3) + len(self.suffix))
+        self.file = None
+        self.seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            data = self.read(4 * self.CHUNK_SIZE // 3)
+            if not data:
+                break
+            yield data
+
+    def seek(self, offset):
+        '''Only used to restart from the beginning when retrying'''
+        assert offset == 0, 'FileJSONBody can only be rewound'
+        self.close()
+        self.parts = None  # generator of the base64 parts of the body
+        self.buffer = ''
+        self.position = 0
+
+    def _generate_parts(self):
+        yield self.prefix
+        self.file = open(self.path, 'rb')
+        try:
+            while True:
+                chunk = self.file.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield base64.b64encode(chunk)
+        finally:
+            self.close()
+        yield self.suffix
+
+    def read(self, size=-1):
+        if self.parts is None:
+            self.parts = self._generate_parts()
+        res = []
+        while size < 0 or size > 0:
+            if self.position >= len(self.buffer):
+                self.buffer = next(self.parts, '')
+                self.position = 0
+                if not self.buffer:
+                    break
+            if size < 0:
+                end = len(self.buffer)
+            else:
+                end = min(self.position + size, len(self.buffer))
+                size -= end - self.position
+            res.append(self.buffer[self.position:end])
+            self.position = end
+        return ''.join(res)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+NOT_BASE64_CHARS = re.compile('[^A-Za-z0-9+/=]')
+
+
+# algorithms of the Digest header (RFC 3230) -> name in hashlib
+DIGEST_ALGORITHMS = {
+    'md5': 'md5',
+    'sha': 'sha1',
+    'sha-256': 'sha256',
+    'sha-512': 'sha512',
+    }
+
+
+class DownloadIntegrityError(ValueError):
+    '''The downloaded content is incomplete or corrupted: the download
+    can be retried'''
+
+
+def expected_digest(headers):
+    '''Returns a tuple (hash object, expected digest in base64) from the
+    Digest or Content-MD5 header of the response, or None if the server
+    didn't send any of them'''
+    for item in (headers.get('Digest') or '').split(','):
+        algo, sep, value = item.strip().partition('=')
+        algo = DIGEST_ALGORITHMS.get(algo.lower())
+        if sep and algo:
+            return hashlib.new(algo), value.strip()
+    if headers.get('Content-MD5'):
+        return hashlib.md5(), headers['Content-MD5'].strip()
+    return None
+
+
+def save_response_content(response, fileobj, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    '''Write the content of a streamed response (stream=True) to fileobj,
+    chunk by chunk. Yousign sends the files as a JSON string in base64:
+    in that case, the content is decoded on the fly. Returns a tuple
+    (size, sha1) of the decoded content.
+    Raises DownloadIntegrityError if the content received is incomplete:
+    fewer bytes than the Content-Length header, base64 content without
+    its padding or its closing quote, or digest different from the one
+    of the Digest/Content-MD5 header.'''
+    checksum = hashlib.sha1()
+    digest = expected_digest(response.headers)
+    size = 0
+    received = 0
+    is_base64 = None
+    quoted = False
+    padded = False
+    tail = ''
+    remainder = ''
+    for chunk in response.iter_content(chunk_size):
+        if not chunk:
+            continue
+        received += len(chunk)
+        if digest:
+            digest[0].update(chunk)
+        if is_base64 is None:
+            head = chunk.lstrip()
+            is_base64 = not head.startswith('%PDF')
+            quoted = head.startswith('"')
+        if is_base64:
+            tail = (tail + chunk)[-16:]
+            data = NOT_BASE64_CHARS.sub('', chunk)
+            if (padded and data) or '=' in data.rstrip('='):
+                raise DownloadIntegrityError(
+                    'Data after the padding of the base64 content')
+            padded = data.endswith('=')
+            chunk = remainder + data
+            cut = len(chunk) - len(chunk) % 4
+            chunk, remainder = base64.b64decode(chunk[:cut]), chunk[cut:]
+        fileobj.write(chunk)
+        checksum.update(chunk)
+        size += len(chunk)
+    if remainder:
+        raise DownloadIntegrityError('Truncated base64 content')
+    if quoted and not tail.rstrip().endswith('"'):
+        raise DownloadIntegrityError(
+            'The base64 content is not terminated by a quote')
+    # with a Content-Encoding, Content-Length is the size before decoding
+    content_length = response.headers.get('Content-Length')
+    if (
+            content_length and
+            not response.headers.get('Content-Encoding') and
+            received != int(content_length)):
+        raise DownloadIntegrityError(
+            'Received %d bytes, %s bytes were expected' % (
+                received, content_length))
+    if digest and base64.b64encode(digest[0].digest()) != digest[1]:
+        raise DownloadIntegrityError(
+            "The content doesn't match the digest sent by the server")
+    return size, checksum.hexdigest()
+
+
+def file_sha1(path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    checksum = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def download_to_tempfile(client, url, directory, retry=None, byte_budget=None):
+    '''Download a file from Yousign to a temporary file in directory,
+    checking its integrity. Safe to use from a worker thread.
+    retry is the RetryPolicy of the GET (None means DEFAULT_RETRY); the
+    whole download is also retried with it when the content received is
+    incomplete or corrupted.
+    byte_budget is an optional ByteBudget (cf executor.py).
+    Returns a tuple (path, size, sha1).'''
+    if retry is None:
+        retry = DEFAULT_RETRY
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return _download_once(client, url, directory, retry, byte_budget)
+        except (
+                DownloadIntegrityError,
+                requests.exceptions.RequestException) as e:
+            if attempt >= retry.max_attempts:
+                raise
+            delay = retry.get_delay(attempt)
+            metrics.inc('yousign_api_retries_total', {
+                'method': 'GET', 'endpoint': endpoint_label(url)})
+            logger.warning(
+                'Download of %s failed (attempt %d/%d): %s. '
+                'Retrying in %.1f seconds.', url, attempt,
+                retry.max_attempts, e, delay)
+            time.sleep(delay)
+
+
+def _download_once(client, url, directory, retry, byte_budget):
+    res = client.call(
+        'GET', url, 200, return_raw=True, stream=True, retry=retry)
+    size_hint = int(res.headers.get('Content-Length') or 0)
+    if byte_budget:
+        byte_budget.acquire(size_hint)
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix='yousign-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                size, checksum = save_response_content(res, tmp_file)
+                metrics.inc('yousign_api_response_bytes_total', {
+                    'method': 'GET', 'endpoint': endpoint_label(url)},
+                    size_hint or size)
+                tracing.record_bytes(size_hint or size)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            if not size:
+                raise ValueError('The downloaded file is empty')
+            if file_sha1(tmp_path) != checksum:
+                raise DownloadIntegrityError(
+                    'Integrity check failed on the written file')
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    finally:
+        res.close()
+        if byte_budget:
+            byte_budget.release(size_hint)
+    return tmp_path, size, checksum
+
+
+class YousignClient(object):
+
+    def __init__(
+            self, url_base, headers, timeouts=None,
+            pool_size=DEFAULT_POOL_SIZE):
+        self.url_base = url_base
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_timeout(self, method, url):
+        return self.timeouts.get(
+            endpoint_class(method, url), self.timeouts['default'])
+
+    def request(self, method, url, retry=None, **kwargs):
+        retry = retry or NO_RETRY
+        kwargs.setdefault('timeout', self.get_timeout(method, url))
+        full_url = self.url_base + url
+        attempt = 0
+        while True:
+            attempt += 1
+            if attempt > 1 and hasattr(kwargs.get('data'), 'seek'):
+                kwargs['data'].seek(0)
+            try:
+                res = self.session.request(method, full_url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if (
+                        attempt >= retry.max_attempts or
+                        not retry.should_retry_exception(method, e)):
+                    raise
+                delay = retry.get_delay(attempt)
+                metrics.inc('yousign_api_retries_total', {
+                    'method': method, 'endpoint': endpoint_label(url)})
+                logger.warning(
+                    '%s request on %s failed (attempt %d/%d): %s. '
+                    'Retrying in %.1f seconds.', method, full_url, attempt,
+                    retry.max_attempts, e, delay)
+            else:
+                if (
+                        attempt >= retry.max_attempts or
+                        not retry.should_retry_response(method, res)):
+                    return res
+                delay = retry.get_delay(attempt, res)
+                if delay is None:
+                    logger.warning(
+                        '%s request on %s returned HTTP %s with a '
+                        'Retry-After header that is too long. Giving up.',
+                        method, full_url, res.status_code)
+                    return res
+                metrics.inc('yousign_api_retries_total', {
+                    'method': method, 'endpoint': endpoint_label(url)})
+                logger.warning(
+                    '%s request on %s returned HTTP %s (attempt %d/%d). '
+                    'Retrying in %.1f seconds.', method, full_url,
+                    res.status_code, attempt, retry.max_attempts, delay)
+                res.close()
+            time.sleep(delay)
+
+    def call(
+            self, method, url, expected_status_code=201, json=None,
+            data=None, return_raw=False, stream=False, retry=None):
+        '''Send the request and check the status code. Returns the decoded
+        JSON answer, or the Response object if return_raw is True.
+        data is an alternative to json for streamed bodies
+        (cf FileJSONBody). With stream=True, the caller must read the
+        content of the Response and close it.
+        retry is a RetryPolicy; None means DEFAULT_RETRY, give NO_RETRY to
+        disable retries. The default is resolved here, so that the calls
+        from the worker threads and from the model behave the same.
+        Raises YousignError. Safe to use from a worker thread.'''
+        if retry is None:
+            retry = DEFAULT_RETRY
+        full_url = self.url_base + url
+        logger.info(
+            'Sending %s request on %s. Expecting status code %d.',
+            method, full_url, expected_status_code)
+        logger.debug('JSON data sent: %s', json)
+        start = time.time()
+        try:
+            res = self.request(
+                method, url, retry=retry, json=json, data=data, stream=stream)
+        except requests.exceptions.ConnectionError as e:
+            observe_call(method, url, 'error', start)
+            logger.error("Connection to %s failed. Error: %s", full_url, e)
+            raise YousignError('connection', method, full_url, error=e)
+        except requests.exceptions.RequestException as e:
+            observe_call(method, url, 'error', start)
+            logger.error("%s request %s failed. Error: %s", method, full_url, e)
+            raise YousignError('technical', method, full_url, error=e)
+        observe_call(
+            method, url, res.status_code, start, res,
+            stream=stream and res.status_code == expected_status_code)
+        if res.status_code != expected_status_code:
+            logger.error('Status code received: %s.', res.status_code)
+            try:
+                res_json = res.json()
+            except Exception:
+                res_json = {}
+            logger.error(
+                "HTTP %s request on %s returned HTTP Code %s (%s was expected). "
+                "Error message: %s (%s).", method, full_url, res.status_code,
+                expected_status_code, res_json.get('title'),
+                res_json.get('detail', 'no detail'))
+            res.close()
+            raise YousignError(
+                'status', method, full_url, status_code=res.status_code,
+                expected_status_code=expected_status_code,
+                title=res_json.get('title'), detail=res_json.get('detail'))
+        if return_raw:
+            return res
+        res_json = res.json()
+        logger.debug('JSON webservice answer: %s', res_json)
+        return res_json
+
+
+def get_client(
+        url_base, headers, timeouts=None, pool_size=DEFAULT_POOL_SIZE):
+    key = (url_base, tuple(sorted(headers.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                logger.debug('Creating Yousign HTTP client for %s', url_base)
+                client = _clients[key] = YousignClient(
+                    url_base, headers, timeouts=timeouts, pool_size=pool_size)
+    return client
+
+
+def clear_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.session.close()
+        _clients.clear()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import openerp
+from openerp import api, http, tools, SUPERUSER_ID
+from openerp.http import request
+from ..models.yousign_request import WEBHOOK_SECRET_HEADER
+from .. import metrics
+import hmac
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+
+class YousignWebhook(http.Controller):
+
+    @http.route(
+        '/yousign/webhook', type='http', auth='none', methods=['POST'])
+    def webhook(self, db=None, **kwargs):
+        secret = tools.config.get('yousign_webhook_secret')
+        received_secret = request.httprequest.headers.get(
+            WEBHOOK_SECRET_HEADER, '')
+        if not secret or not hmac.compare_digest(
+                str(secret), str(received_secret)):
+            logger.warning(
+                'Yousign webhook rejected: wrong secret from %s',
+                request.httprequest.remote_addr)
+            return http.Response('Forbidden', status=403)
+        db = db or request.db
+        if not db or not http.db_filter([db]):
+            return http.Response('Unknown database', status=400)
+        try:
+            payload = json.loads(request.httprequest.get_data())
+        except ValueError:
+            return http.Response('Invalid JSON', status=400)
+        registry = openerp.registry(db)
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['yousign.request'].process_webhook(payload)
+        return http.Response('OK')
+
+    @http.route(
+        '/yousign/metrics', type='http', auth='none', methods=['GET'])
+    def yousign_metrics(self, db=None, **kwargs):
+        '''Metrics in the text format of Prometheus. Only available with
+        the token of the config key yousign_metrics_token in the header
+        "Authorization: Bearer", or from the Odoo server itself when no
+        token is set. Behind a reverse proxy (proxy_mode), all the clients
+        may come from 127.0.0.1, so the token is required.'''
+        token = tools.config.get('yousign_metrics_token')
+        auth = request.httprequest.headers.get('Authorization', '')
+        if token:
+            allowed = hmac.compare_digest(
+                str('Bearer %s' % token), str(auth))
+        elif tools.config.get('proxy_mode'):
+            logger.warning(
+                'Yousign metrics rejected: yousign_metrics_token is '
+                'required when proxy_mode is enabled')
+            allowed = False
+        else:
+            allowed = request.httprequest.remote_addr in (
+                '127.0.0.1', '::1')
+        if not allowed:
+            return http.Response('Forbidden', status=403)
+        samples = []
+        db = db or request.db
+        if db and http.db_filter([db]):
+            registry = openerp.registry(db)
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                # the totals of all the Odoo processes, crons included
+                env['yousign.metric'].flush()
+                samples = env['yousign.metric'].get_samples()
+                samples += env['yousign.request'].metrics_gauges()
+        return http.Response(
+            metrics.render(samples).encode('utf-8'),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import Queue
+import sys
+import threading
+from . import tracing
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _worker(task_queue, done_queue, trace):
+    # the requests to Yousign are counted in the trace of the caller
+    tracing.activate(trace)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        key, func, args = task
+        try:
+            done_queue.put((key, True, func(*args)))
+        except Exception:
+            done_queue.put((key, False, sys.exc_info()))
+
+
+def capture_errors(func, *args, **kwargs):
+    '''Returns (result, None), or (None, exception) if func raised an
+    exception. Useful when the failure of a task should not stop the
+    other tasks of a TaskGraph.'''
+    try:
+        return func(*args, **kwargs), None
+    except Exception as e:
+        return None, e
+
+
+class ByteBudget(object):
+    '''Limit the number of bytes in flight between several threads. A
+    transfer bigger than the budget is allowed when it is alone.'''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        with self.condition:
+            while self.in_flight and self.in_flight + size > self.max_bytes:
+                self.condition.wait()
+            self.in_flight += size
+
+    def release(self, size):
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+class TaskGraph(object):
+    '''Run tasks on a bounded thread pool. A task is started as soon as
+    all the tasks it depends on are finished; the results of these tasks
+    are given to it as positional arguments, in the order of 'depends'.
+    'after' adds dependencies that only constrain the execution order.
+
+    The tasks run in threads, so they must NOT use the ORM: they should
+    only do network I/O on data prepared beforehand.
+    If a task fails, no new task is started and the exception is raised
+    once the running tasks are finished.'''
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max(max_workers, 1)
+        self.tasks = []  # list of (key, func, depends, after)
+        self.keys = set()
+
+    def add(self, key, func, depends=(), after=()):
+        if key in self.keys:
+            raise ValueError('Task %r already added' % (key, ))
+        self.keys.add(key)
+        self.tasks.append((key, func, tuple(depends), tuple(after)))
+        return key
+
+    def _ready(self, pending, results):
+        for task in pending:
+            key, func, depends, after = task
+            if all(dep in results for dep in depends + after):
+                yield task
+
+    def run(self, on_done=None):
+        '''Returns a dict with key = task key, value = task result.
+        on_done(key, result) is called in the calling thread each time a
+        task is finished successfully, for example to save the progress.'''
+        for key, func, depends, after in self.tasks:
+            for dep in depends + after:
+                if dep not in self.keys:
+                    raise ValueError(
+                        'Task %r depends on unknown task %r' % (key, dep))
+        results = {}
+        pending = list(self.tasks)
+        if self.max_workers == 1:
+            while pending:
+                task = next(self._ready(pending, results), None)
+                if task is None:
+                    raise ValueError('Circular dependency between tasks')
+                pending.remove(task)
+                key, func, depends, after = task
+                results[key] = func(*[results[dep] for dep in depends])
+                if on_done:
+                    on_done(key, results[key])
+            return results
+
+        task_queue = Queue.Queue()
+        done_queue = Queue.Queue()
+        trace = tracing.current()
+        workers = [
+            threading.Thread(
+                target=_worker, args=(task_queue, done_queue, trace))
+            for i in range(min(self.max_workers, len(pending)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        running = 0
+        exc_info = None
+        try:
+            while True:
+                if exc_info is None:
+                    for task in list(self._ready(pending, results)):
+                        pending.remove(task)
+                        key, func, depends, after = task
+                        args = [results[dep] for dep in depends]
+                        task_queue.put((key, func, args))
+                        running += 1
+                if not running:
+                    break
+                key, success, value = done_queue.get()
+                running -= 1
+                if success:
+                    results[key] = value
+                    if on_done:
+                        # also for the tasks that finish after a failure
+                        try:
+                            on_done(key, value)
+                        except Exception:
+                            if exc_info is None:
+                                exc_info = sys.exc_info()
+                elif exc_info is None:
+                    logger.debug('Task %r failed', key)
+                    exc_info = value
+        finally:
+            for worker in workers:
+                task_queue.put(None)
+            for worker in workers:
+                worker.join()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if pending:
+            raise ValueError('Circular dependency between tasks')
+        return results
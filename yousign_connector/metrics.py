@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+'''Counters and histograms rendered in the text format of Prometheus by
+the controller /yousign/metrics. Each Odoo process keeps the increments
+in memory until they are added to the table of the model yousign.metric
+(cf flush() of that model, called after each operation and each batch
+of the crons), so the controller renders the totals of all the
+processes, crons included. Safe to use from worker threads.'''
+
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# name: (type, help, buckets)
+METRICS = {
+    'yousign_api_requests_total': (
+        'counter', 'Requests to the Yousign API', None),
+    'yousign_api_request_duration_seconds': (
+        'histogram', 'Duration of the requests to the Yousign API, '
+        'retries included', DURATION_BUCKETS),
+    'yousign_api_retries_total': (
+        'counter', 'Requests to the Yousign API that were retried', None),
+    'yousign_api_request_bytes_total': (
+        'counter', 'Bytes sent to the Yousign API', None),
+    'yousign_api_response_bytes_total': (
+        'counter', 'Bytes received from the Yousign API', None),
+    'yousign_cron_batch_duration_seconds': (
+        'histogram', 'Duration of the batches of the Yousign crons',
+        DURATION_BUCKETS),
+    'yousign_requests': (
+        'gauge', 'Yousign requests per state', None),
+    'yousign_requests_due': (
+        'gauge', 'Yousign requests waiting for the cron', None),
+    }
+
+_lock = threading.Lock()
+# Increments not flushed yet. A histogram is stored as its series:
+# <name>_bucket (one per bound, cumulative, label le), <name>_sum and
+# <name>_count, so that the values of several processes can be summed.
+# key = (series name, sorted labels tuple), value = number
+_pending = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+
+def inc(name, labels=None, value=1):
+    key = _key(name, labels)
+    with _lock:
+        _pending[key] = _pending.get(key, 0) + value
+
+
+def observe(name, value, labels=None):
+    buckets = METRICS[name][2]
+    labels = labels or {}
+    series = [
+        ('_bucket', dict(labels, le='%g' % bound), 1)
+        for bound in buckets if value <= bound]
+    series += [
+        ('_bucket', dict(labels, le='+Inf'), 1),
+        ('_sum', labels, value),
+        ('_count', labels, 1),
+        ]
+    with _lock:
+        for suffix, series_labels, delta in series:
+            key = _key(name + suffix, series_labels)
+            _pending[key] = _pending.get(key, 0) + delta
+
+
+def drain():
+    '''Returns the increments not flushed yet and forgets them'''
+    global _pending
+    with _lock:
+        res, _pending = _pending, {}
+    return res
+
+
+def restore(values):
+    '''Put back increments returned by drain(), when they could not be
+    flushed'''
+    with _lock:
+        for key, value in values.items():
+            _pending[key] = _pending.get(key, 0) + value
+
+
+def reset():
+    with _lock:
+        _pending.clear()
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace(
+        '\n', '\\n').replace('"', '\\"')
+
+
+def _labels_str(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join([
+        u'%s="%s"' % (name, _escape(value)) for (name, value) in labels])
+
+
+def _series_order(key):
+    '''Sort the series of a histogram by labels, then buckets by bound,
+    then sum and count'''
+    name, labels = key
+    le = dict(labels).get('le')
+    labels = tuple([item for item in labels if item[0] != 'le'])
+    if le is not None:
+        return (labels, 0, float(le))
+    return (labels, name.endswith('_count') and 2 or 1, 0)
+
+
+def render(samples):
+    '''Returns the metrics in the text format of Prometheus.
+    samples is a list of (series name, labels dict, value): the totals
+    of the table of yousign.metric and the gauges computed from the
+    database by the caller.'''
+    values = {}
+    for name, labels, value in samples:
+        key = _key(name, labels)
+        values[key] = values.get(key, 0) + value
+    lines = []
+    for name in sorted(METRICS):
+        mtype, mhelp, buckets = METRICS[name]
+        if mtype == 'histogram':
+            names = (name + '_bucket', name + '_sum', name + '_count')
+            keys = sorted(
+                [key for key in values if key[0] in names],
+                key=_series_order)
+        else:
+            keys = sorted([key for key in values if key[0] == name])
+        if not keys:
+            continue
+        lines.append('# HELP %s %s' % (name, mhelp))
+        lines.append('# TYPE %s %s' % (name, mtype))
+        for key in keys:
+            if key[0].endswith('_sum'):
+                value = repr(float(values[key]))
+            else:
+                value = '%d' % values[key]
+            lines.append(u'%s%s %s' % (key[0], _labels_str(key[1]), value))
+    return u'\n'.join(lines) + u'\n'
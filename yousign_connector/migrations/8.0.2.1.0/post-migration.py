@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from openerp import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    if not version:
+        return
+
+    # The cron only checks the requests with next_check_at in the past
+    cr.execute(
+        "UPDATE yousign_request SET next_check_at=(now() at time zone 'UTC') "
+        "WHERE state IN ('sent', 'signed') AND next_check_at IS NULL")
+
+    # The bulk wizard is only added to the Action menu by create_button()
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['yousign.request.template'].search([
+        ('ir_act_window_id', '!=', False),
+        ('bulk_act_window_id', '=', False)]).create_bulk_button()
@@ -2,3 +2,7 @@
 
 from . import yousign_request
 from . import yousign_request_template
+from . import yousign_pdf_info
+from . import yousign_report_cache
+from . import yousign_request_checkpoint
+from . import yousign_metric
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from openerp import api, fields, models
+from .. import metrics
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+
+class YousignMetric(models.Model):
+    '''Totals of the counters and histograms of metrics.py, shared by all
+    the Odoo processes: each process adds its increments with flush().
+    Written with raw SQL in a separate cursor, so the increments are kept
+    when the transaction of the caller is rolled back.'''
+    _name = 'yousign.metric'
+    _description = 'Metrics of the Yousign connector'
+    _log_access = False
+
+    name = fields.Char(string='Series', required=True, readonly=True)
+    # JSON of the sorted labels
+    labels = fields.Char(required=True, readonly=True)
+    value = fields.Float(readonly=True)
+
+    _sql_constraints = [(
+        'name_labels_uniq',
+        'unique(name, labels)',
+        'This metric already exists!')]
+
+    @api.model
+    def flush(self):
+        '''Add the increments of this process to the table. Never raises:
+        the increments are kept in memory for the next flush if the
+        database is not available.'''
+        values = metrics.drain()
+        if not values:
+            return
+        try:
+            with self.pool.cursor() as cr:
+                for (name, labels), value in sorted(values.items()):
+                    cr.execute(
+                        "INSERT INTO yousign_metric (name, labels, value) "
+                        "VALUES (%s, %s, %s) ON CONFLICT (name, labels) "
+                        "DO UPDATE SET value = yousign_metric.value + "
+                        "EXCLUDED.value",
+                        (name, json.dumps(labels), value))
+        except Exception:
+            logger.exception('Failed to flush the Yousign metrics')
+            metrics.restore(values)
+
+    @api.model
+    def get_samples(self):
+        '''Returns a list of (series name, labels dict, value)'''
+        self._cr.execute("SELECT name, labels, value FROM yousign_metric")
+        return [
+            (name, dict(json.loads(labels)), value)
+            for (name, labels, value) in self._cr.fetchall()]
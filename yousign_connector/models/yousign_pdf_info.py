@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from openerp import api, fields, models
+from ..pdf_info import inspect_pdf
+from StringIO import StringIO
+import hashlib
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+
+class YousignPdfInfo(models.Model):
+    _name = 'yousign.pdf.info'
+    _description = 'Cache of the properties of the PDF files to sign'
+    _rec_name = 'checksum'
+
+    checksum = fields.Char(
+        string='SHA1 Checksum', required=True, readonly=True, select=True)
+    num_pages = fields.Integer(string='Number of Pages', readonly=True)
+    last_page_mediabox = fields.Char(
+        string='Last Page MediaBox', readonly=True,
+        help="llx,lly,urx,ury")
+    encrypted = fields.Boolean(readonly=True)
+    valid = fields.Boolean(readonly=True)
+    error = fields.Char(readonly=True)
+
+    _sql_constraints = [(
+        'checksum_uniq',
+        'unique(checksum)',
+        'There is already a PDF info for this checksum!')]
+
+    @api.model
+    def attachment_checksum(self, attach):
+        # In the filestore, the name of the file is its SHA1
+        if attach.store_fname:
+            return os.path.basename(attach.store_fname)
+        return hashlib.sha1(
+            (attach.datas or '').decode('base64')).hexdigest()
+
+    @api.model
+    def get_attachment_info(self, attach):
+        '''Returns the yousign.pdf.info of the attachment. The PDF is only
+        parsed the first time we see its content.'''
+        checksum = self.attachment_checksum(attach)
+        info = self.sudo().search([('checksum', '=', checksum)], limit=1)
+        if info:
+            return info
+        path = self.env['yousign.request'].attachment_path(attach)
+        if path:
+            pdf_file = open(path, 'rb')
+        else:
+            pdf_file = StringIO((attach.datas or '').decode('base64'))
+        try:
+            vals = inspect_pdf(pdf_file)
+        finally:
+            pdf_file.close()
+        logger.debug(
+            'PDF %s (%s) inspected: %s', attach.datas_fname, checksum, vals)
+        vals['checksum'] = checksum
+        try:
+            with self._cr.savepoint():
+                info = self.sudo().create(vals)
+        except Exception:
+            # created in the meantime by another transaction
+            info = self.sudo().search([('checksum', '=', checksum)], limit=1)
+            if not info:
+                raise
+        return info
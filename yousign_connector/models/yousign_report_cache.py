@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from openerp import api, fields, models
+from datetime import datetime, timedelta
+import logging
+logger = logging.getLogger(__name__)
+
+
+class YousignReportCache(models.Model):
+    _name = 'yousign.report.cache'
+    _description = 'Cache of the reports rendered as documents to sign'
+    _rec_name = 'attachment_id'
+
+    report_id = fields.Many2one(
+        'ir.actions.report.xml', string='Report', required=True,
+        ondelete='cascade', readonly=True, select=True)
+    res_id = fields.Integer(
+        string='Related Document ID', required=True, readonly=True,
+        select=True)
+    source_write_date = fields.Datetime(
+        string='Last Modification of the Related Document', required=True,
+        readonly=True)
+    lang = fields.Char(string='Language', required=True, readonly=True)
+    attachment_id = fields.Many2one(
+        'ir.attachment', string='Rendered Report', required=True,
+        ondelete='cascade', readonly=True)
+
+    _sql_constraints = [(
+        'key_uniq',
+        'unique(report_id, res_id, source_write_date, lang)',
+        'There is already a rendered report for this record version!')]
+
+    @api.model
+    def _cache_key(self, report, source_obj):
+        '''Returns the values that identify the rendered report, or None
+        if the report of this record can't be cached'''
+        write_date = getattr(source_obj, 'write_date', False)
+        if not write_date:
+            return None
+        return {
+            'report_id': report.id,
+            'res_id': source_obj.id,
+            'source_write_date': write_date,
+            'lang': self._context.get('lang') or 'en_US',
+            }
+
+    @api.model
+    def get_report_attachment(self, report, source_obj):
+        '''Returns the attachment of the report of source_obj. The report
+        is only rendered again if the record was modified since the last
+        rendering in the same language.'''
+        key = self._cache_key(report, source_obj)
+        if key:
+            entry = self.sudo().search(
+                [(fname, '=', value) for (fname, value) in key.items()],
+                limit=1)
+            if entry:
+                logger.debug(
+                    'Report %s of record ID %d found in cache',
+                    report.report_name, source_obj.id)
+                # the entries are aged by last use (cf purge())
+                self._cr.execute(
+                    "UPDATE yousign_report_cache SET write_date = "
+                    "(now() at time zone 'UTC') WHERE id = %s", (entry.id, ))
+                return self.env['ir.attachment'].browse(
+                    entry.attachment_id.id)
+        attach = self.env['yousign.request'].render_report_attachment(
+            report, source_obj)
+        if key:
+            try:
+                with self._cr.savepoint():
+                    self.sudo().create(dict(key, attachment_id=attach.id))
+            except Exception:
+                # rendered in the meantime by another transaction
+                logger.debug(
+                    'Report %s of record ID %d already in cache',
+                    report.report_name, source_obj.id)
+        return attach
+
+    @api.model
+    def warm_cache(self, template_id, res_ids):
+        '''Render in advance the report of the Yousign request template
+        for the records, so that the Yousign wizard opens quickly.
+        Designed to be called from a cron or a server action, for example
+        when a quotation is confirmed.'''
+        template = self.env['yousign.request.template'].browse(template_id)
+        if not template.report_id:
+            return 0
+        count = 0
+        for source_obj in self.env[template.model].browse(res_ids).exists():
+            try:
+                with self._cr.savepoint():
+                    self.get_report_attachment(template.report_id, source_obj)
+                count += 1
+            except Exception as e:
+                logger.warning(
+                    'Failed to render report %s of %s ID %d: %s',
+                    template.report_id.report_name, template.model,
+                    source_obj.id, e)
+        logger.info(
+            'Yousign report cache warmed for %d/%d %s',
+            count, len(res_ids), template.model)
+        return count
+
+    @api.model
+    def purge(self, max_age_days=30):
+        '''Remove the entries that were not used for max_age_days: their
+        attachments are then deleted as orphan attachments by
+        yousign.request.cron_purge_orphan_attachments()'''
+        limit_date = fields.Datetime.to_string(
+            datetime.now() - timedelta(days=max_age_days))
+        self._cr.execute(
+            "DELETE FROM yousign_report_cache WHERE write_date < %s",
+            (limit_date, ))
+        logger.info(
+            'Yousign purge: %d report cache entries deleted',
+            self._cr.rowcount)
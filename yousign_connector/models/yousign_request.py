@@ -6,24 +6,46 @@
 from openerp import api, fields, models, tools, _
 from openerp.exceptions import Warning as UserError
 from openerp.exceptions import ValidationError
-from openerp.addons.email_template import email_template
+from ..client import DEFAULT_TIMEOUTS, DEFAULT_POOL_SIZE, get_client,\
+    CRON_RETRY, YousignError, FileJSONBody,\
+    download_to_tempfile
+from ..executor import TaskGraph, ByteBudget, capture_errors
+from .. import metrics
+from .. import tracing
+from ..tracing import traced
 from unidecode import unidecode
-from StringIO import StringIO
+from functools import partial
 # from pprint import pprint
+import os
+import psycopg2
 import re
+from datetime import datetime, timedelta
+import time
 import logging
 logger = logging.getLogger(__name__)
 
-try:
-    import requests
-except ImportError:
-    logger.debug('Cannot import requests')
-try:
-    import PyPDF2
-except ImportError:
-    logger.debug('Cannot import PyPDF2')
+WEBHOOK_EVENTS = ['member.finished', 'procedure.finished', 'procedure.refused']
+WEBHOOK_SECRET_HEADER = 'X-Odoo-Yousign-Secret'
+URL_TAG_REGEXP = '{yousignUrl\|.+}'
+# Polling schedule of the cron: the interval between 2 checks starts at
+# POLL_BASE_HOURS (depending on the age of the request) and is doubled
+# after each check without change or failed check, up to POLL_MAX_HOURS.
+# After POLL_MAX_AGE_DAYS, the cron doesn't check the request any more.
+POLL_BASE_HOURS = [(1, 1), (7, 6), (None, 24)]  # (max age in days, hours)
+POLL_MAX_HOURS = 7 * 24
+POLL_MAX_AGE_DAYS = 180
+
+
+def create_index(cr, name, table, columns, where=None):
+    cr.execute("SELECT 1 FROM pg_indexes WHERE indexname=%s", (name, ))
+    if cr.fetchone():
+        return
+    logger.info('Creating index %s on table %s', name, table)
+    query = 'CREATE INDEX %s ON %s (%s)' % (name, table, columns)
+    if where:
+        query += ' WHERE %s' % where
+    cr.execute(query)
 
-TIMEOUT = 30
 
 # ROADMAP:
 # POST /consent_processes + POST /consent_process_values
@@ -46,10 +68,10 @@ class YousignRequest(models.Model):
         compute='_compute_res_name', string="Related Document Name",
         store=True, readonly=True)
     model = fields.Char(
-        string='Related Document Model', select=True, readonly=True,
+        string='Related Document Model', readonly=True,
         track_visibility='onchange')
     res_id = fields.Integer(
-        string='Related Document ID', select=True, readonly=True,
+        string='Related Document ID', readonly=True,
         track_visibility='onchange')
     ordered = fields.Boolean(string='Sign one after the other')
     init_mail_subject = fields.Char(
@@ -79,6 +101,7 @@ class YousignRequest(models.Model):
         readonly=True, states={'draft': [('readonly', False)]})
     state = fields.Selection([
         ('draft', 'Draft'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('signed', 'Signed'),
         ('archived', 'Archived'),
@@ -92,8 +115,29 @@ class YousignRequest(models.Model):
         default=lambda self: self.env['res.company']._company_default_get(
             'yousign.request'))
     ys_identifier = fields.Char(
-        'Yousign ID', readonly=True, track_visibility='onchange')
+        'Yousign ID', readonly=True, track_visibility='onchange', select=True)
     last_update = fields.Datetime(string='Last Status Update', readonly=True)
+    send_error = fields.Text(
+        string='Sending Error', readonly=True, copy=False,
+        help="Error of the last sending in the background")
+    report_pending_id = fields.Many2one(
+        'ir.actions.report.xml', string='Report to Render', readonly=True,
+        copy=False,
+        help="Report of the template that will be rendered and added to the "
+        "documents to sign just before sending the request.")
+    trace_timeline = fields.Text(
+        string='Last Trace', readonly=True, copy=False,
+        help="Duration, requests to Yousign and bytes of each phase of "
+        "the last operation on the request. Only written when the config "
+        "key yousign_tracing is set to 'store'.")
+    next_check_at = fields.Datetime(
+        string='Next Status Check', readonly=True, copy=False,
+        help="Date from which the cron will check the status of the request "
+        "on Yousign. Empty when the cron doesn't need to check the request.")
+    unchanged_check_count = fields.Integer(
+        string='Checks Without Change', readonly=True, copy=False)
+    check_failure_count = fields.Integer(
+        string='Failed Checks', readonly=True, copy=False)
     remind_auto = fields.Boolean(
         string='Automatic Reminder',
         readonly=True, states={'draft': [('readonly', False)]})
@@ -122,15 +166,61 @@ class YousignRequest(models.Model):
             'The Remind Limit must be positive or null.'),
         ]
 
+    def init(self, cr):
+        # Cf scripts/explain_indexes.py to check that they are used
+        # These single-column indexes (formerly select=True) are covered by
+        # yousign_request_cron_index and yousign_request_model_res_id_index:
+        # drop them so that the writes of the cron don't maintain them
+        for column in ('next_check_at', 'model', 'res_id'):
+            cr.execute(
+                'DROP INDEX IF EXISTS %s_%s_index' % (self._table, column))
+        # cron_update(): the WHERE clause must stay the same as in
+        # _cron_claim_batch() so that the partial index can be used
+        create_index(
+            cr, 'yousign_request_cron_index', self._table,
+            'state, next_check_at',
+            "state IN ('sent', 'signed') "
+            "AND ys_identifier LIKE '/procedures/%'")
+        # list view: filter on state and company, order by id desc
+        create_index(
+            cr, 'yousign_request_state_company_index', self._table,
+            'state, company_id, id')
+        create_index(
+            cr, 'yousign_request_model_res_id_index', self._table,
+            'model, res_id')
+
     @api.multi
     @api.depends('model', 'res_id')
     def _compute_res_name(self):
+        # one name_get() per model
+        sources = self.get_source_objects()
+        names = {}
+        for model in set([src._name for src in sources.values() if src]):
+            records = self.env[model].browse([
+                src.id for src in sources.values()
+                if src and src._name == model])
+            names.update(dict([
+                ((model, res_id), name)
+                for (res_id, name) in records.name_get()]))
         for req in self:
-            name = 'None'
-            if req.res_id and req.model:
-                obj = self.env[req.model].browse(req.res_id)
-                name = obj.display_name
-            req.res_name = name
+            req.res_name = names.get((req.model, req.res_id), 'None')
+
+    @api.onchange('attachment_ids')
+    def attachment_ids_change(self):
+        ypio = self.env['yousign.pdf.info']
+        invalid_files = []
+        for attach in self.attachment_ids:
+            if not ypio.get_attachment_info(attach).valid:
+                invalid_files.append(attach.datas_fname or attach.name)
+        if invalid_files:
+            return {'warning': {
+                'title': _('Invalid PDF files'),
+                'message': _(
+                    "The following documents to sign are not valid PDF "
+                    "files: %s. You must convert them to PDF before "
+                    "sending the Yousign request.")
+                % ', '.join(invalid_files),
+                }}
 
     @api.model
     def _lang_get(self):
@@ -138,12 +228,10 @@ class YousignRequest(models.Model):
         return [(lang.code, lang.name) for lang in langs]
 
     @api.model
+    @traced('default_get')
     def default_get(self, fields_list):
+        tracing.phase('defaults')
         res = super(YousignRequest, self).default_get(fields_list)
-        eto = self.env['email.template']
-        iarxo = self.env['ir.actions.report.xml']
-        iao = self.env['ir.attachment']
-        yrto = self.env['yousign.request.template']
         model = self._context.get('active_model')
         res_id = self._context.get('active_id')
         if not model or not res_id:
@@ -153,13 +241,16 @@ class YousignRequest(models.Model):
             return res
         if model == self._name:
             return res
+        tracing.phase('template')
+        template = self.get_template_from_context(model)
+        res.update(
+            self.prepare_from_template(template, model, [res_id])[res_id])
+        return res
+
+    @api.model
+    def get_template_from_context(self, model):
+        yrto = self.env['yousign.request.template']
         template = False
-        if self._context.get('yousign_template_xmlid'):
-            try:
-                template = self.env.ref(
-                    self._context['yousign_template_xmlid'])
-            except Exception:
-                pass
         if self._context.get('yousign_template_id'):
             try:
                 template = yrto.browse(self._context['yousign_template_id'])
@@ -167,84 +258,149 @@ class YousignRequest(models.Model):
                     'Using yousign request template %s ID %d',
                     template.name, template.id)
             except Exception:
-                pass
+                template = False
         if not template:
-            templates = yrto.search([('model', '=', model)])
-            if templates:
-                template = templates[0]
+            # cached resolution by XMLID or by model
+            template_id = yrto._get_template_id(
+                model, self._context.get('yousign_template_xmlid') or False,
+                self.env.user.company_id.id)
+            template = yrto.browse(template_id)
         if not template:
             raise UserError(_(
                 "No Yousign Request Template for model %s") % model)
-        # print "model=%s, res_id=%s" % (model, res_id)
+        return template
+
+    @api.model
+    def prepare_from_template(
+            self, template, model, res_ids, defer_report=False):
+        '''Returns a dict with key = res_id, value = values to create the
+        Yousign request of that record. Each dynamic field of the template
+        is rendered once per language for all the records.
+        With defer_report, the report of the template is not rendered
+        now: it will be rendered by send() (cf render_pending_reports()),
+        or by the sending cron for the draft requests.'''
+        yrto = self.env['yousign.request.template']
+        # print "model=%s, res_ids=%s" % (model, res_ids)
         if model != template.model:
             raise UserError(_(
                 "Wrong active_model (%s should be %s)")
-                % (self._context.get('active_model'), template.model))
-        source_obj = self.env[model].browse(int(res_id))
-        signatory_ids = []
+                % (model, template.model))
+        tracing.phase('render')
+        signatory_ids = dict([(res_id, []) for res_id in res_ids])
         for signatory in template.signatory_ids:
-            signatory_vals = signatory.prepare_template2request(
-                model, res_id)
-            signatory_ids.append((0, 0, signatory_vals))
-        notification_ids = []
+            signatory_vals = signatory.prepare_template2request_batch(
+                model, res_ids)
+            for res_id in res_ids:
+                signatory_ids[res_id].append((0, 0, signatory_vals[res_id]))
+        notification_ids = dict([(res_id, []) for res_id in res_ids])
         for notif in template.notification_ids:
-            notif_vals = notif.prepare_template2request(model, res_id)
-            notification_ids.append((0, 0, notif_vals))
+            notif_vals = notif.prepare_template2request_batch(model, res_ids)
+            for res_id in res_ids:
+                notification_ids[res_id].append((0, 0, notif_vals[res_id]))
+        langs = yrto.render_template_batch(template, 'lang', model, res_ids)
+        res_ids_by_lang = {}
+        for res_id in res_ids:
+            res_ids_by_lang.setdefault(langs[res_id], []).append(res_id)
+        dyn_fields = [
+            'init_mail_subject', 'init_mail_body',
+            'remind_mail_subject', 'remind_mail_body']
+        dyn_values = dict([(res_id, {}) for res_id in res_ids])
+        for lang, lang_res_ids in res_ids_by_lang.iteritems():
+            lang_template = template
+            if lang:
+                lang_template = template.with_context(lang=lang)
+            for field_name in dyn_fields:
+                rendered = yrto.render_template_batch(
+                    lang_template, field_name, model, lang_res_ids)
+                for res_id in lang_res_ids:
+                    dyn_values[res_id][field_name] = rendered[res_id]
+        template_vals = template.prepare_template2request()
+        tracing.phase('report')
+        res = {}
+        for res_id in res_ids:
+            source_obj = self.env[model].browse(int(res_id))
+            vals = dict(dyn_values[res_id], **template_vals)
+            vals.update({
+                'name': source_obj.display_name,
+                'model': model,
+                'res_id': res_id,
+                'lang': langs[res_id],
+                'signatory_ids': signatory_ids[res_id],
+                'notification_ids': notification_ids[res_id],
+                })
+            if defer_report and template.report_id:
+                vals['report_pending_id'] = template.report_id.id
+            else:
+                vals['attachment_ids'] = self.prepare_report_attachment(
+                    template, source_obj)
+            res[res_id] = vals
+        return res
+
+    @api.model
+    def prepare_report_attachment(self, template, source_obj):
         attachment_ids = []
         if template.report_id:
-            report = template.report_id
-            report_data_bin, filename_ext = iarxo.render_report(
-                [res_id], report.report_name, {})
-
-            full_filename = 'document_to_sign.%s' % filename_ext
-            if report.download_filename:
-                full_filename = email_template.mako_template_env\
-                    .from_string(report.download_filename)\
-                    .render({
-                        'objects': source_obj,
-                        'o': source_obj,
-                        'object': source_obj,
-                        'ext': report.report_type.replace('qweb-', ''),
-                    })
-            elif source_obj.display_name:
-                tmp_filename = source_obj.display_name[:50]
-                tmp_filename = tmp_filename.replace(' ', '_')
-                tmp_filename = unidecode(tmp_filename)
-                full_filename = '%s.%s' % (tmp_filename, filename_ext)
-            attach_vals = {
-                'name': full_filename,
-                # 'res_id': Signature request is not created yet
-                'res_model': self._name,
-                'datas': report_data_bin.encode('base64'),
-                'datas_fname': full_filename,
-                }
-            attach = iao.create(attach_vals)
+            attach = self.env['yousign.report.cache'].get_report_attachment(
+                template.report_id, source_obj)
             attachment_ids.append((6, 0, [attach.id]))
-        lang = eto.render_template_batch(
-            template.lang, model, [res_id])[res_id]
-        if lang:
-            template = template.with_context(lang=lang)
-        dyn_fields = {
-            'init_mail_subject': template.init_mail_subject,
-            'init_mail_body': template.init_mail_body,
-            'remind_mail_subject': template.remind_mail_subject,
-            'remind_mail_body': template.remind_mail_body,
+        return attachment_ids
+
+    @api.model
+    def render_report_attachment(self, report, source_obj):
+        iarxo = self.env['ir.actions.report.xml']
+        report_data_bin, filename_ext = iarxo.render_report(
+            [source_obj.id], report.report_name, {})
+
+        full_filename = 'document_to_sign.%s' % filename_ext
+        if report.download_filename:
+            full_filename = self.env['yousign.request.template']\
+                .get_compiled_template(report, 'download_filename')\
+                .render({
+                    'objects': source_obj,
+                    'o': source_obj,
+                    'object': source_obj,
+                    'ext': report.report_type.replace('qweb-', ''),
+                })
+        elif source_obj.display_name:
+            tmp_filename = source_obj.display_name[:50]
+            tmp_filename = tmp_filename.replace(' ', '_')
+            tmp_filename = unidecode(tmp_filename)
+            full_filename = '%s.%s' % (tmp_filename, filename_ext)
+        attach_vals = {
+            'name': full_filename,
+            # 'res_id': Signature request is not created yet
+            'res_model': self._name,
+            'datas': report_data_bin.encode('base64'),
+            'datas_fname': full_filename,
             }
-        for field_name, field_content in dyn_fields.iteritems():
-            dyn_fields[field_name] = eto.render_template_batch(
-                dyn_fields[field_name], model, [res_id])[res_id]
-        res.update(dyn_fields)
-        res.update(template.prepare_template2request())
-        res.update({
-            'name': source_obj.display_name,
-            'model': model,
-            'res_id': res_id,
-            'lang': lang,
-            'signatory_ids': signatory_ids,
-            'notification_ids': notification_ids,
-            'attachment_ids': attachment_ids,
-            })
-        return res
+        return self.env['ir.attachment'].create(attach_vals)
+
+    @api.multi
+    def render_pending_reports(self):
+        '''Render the reports left by prepare_from_template(defer_report=True)
+        and add them to the documents to sign'''
+        reqs = self.filtered(lambda x: x.report_pending_id)
+        sources = reqs.get_source_objects()
+        for req in reqs:
+            source_obj = sources[req.id]
+            if not source_obj:
+                raise UserError(_(
+                    "The related document of request %s doesn't exist any "
+                    "more, so its report can't be rendered.")
+                    % req.display_name)
+            yrco = self.env['yousign.report.cache']
+            if req.lang:
+                yrco = yrco.with_context(lang=req.lang)
+                source_obj = source_obj.with_context(lang=req.lang)
+            logger.info(
+                'Rendering report %s for YS request %s ID %d',
+                req.report_pending_id.report_name, req.name, req.id)
+            attach = yrco.get_report_attachment(
+                req.report_pending_id, source_obj)
+            req.write({
+                'attachment_ids': [(4, attach.id)],
+                'report_pending_id': False,
+                })
 
     @api.model
     def create(self, vals):
@@ -253,21 +409,52 @@ class YousignRequest(models.Model):
                 'yousign.request')
         return super(YousignRequest, self).create(vals)
 
+    @api.multi
+    def get_source_objects(self):
+        '''Returns a dict with key = request ID, value = source record,
+        or None if the request has no source record or if it was deleted.
+        The source records of the same model are browsed together, so
+        there is one query per model and they share the prefetching.'''
+        res_ids_by_model = {}
+        for req in self:
+            if req.model and req.res_id and req.model in self.env.registry:
+                res_ids_by_model.setdefault(req.model, set()).add(req.res_id)
+        existing = {}
+        for model, res_ids in res_ids_by_model.items():
+            records = self.env[model].browse(list(res_ids)).exists()
+            for record in records:
+                existing[(model, record.id)] = record
+        return dict([
+            (req.id, existing.get((req.model, req.res_id)))
+            for req in self])
+
+    @api.multi
+    def get_source_objects_with_chatter(self):
+        res = self.get_source_objects()
+        for req_id, src_obj in res.items():
+            if src_obj is not None and not hasattr(src_obj, 'message_post'):
+                res[req_id] = None
+        return res
+
+    @api.multi
     def get_source_object(self):
         self.ensure_one()
-        if self.model and self.res_id:
-            src_obj = self.env[self.model].browse(self.res_id)
-            return src_obj
-        else:
-            return None
+        return self.get_source_objects()[self.id]
+
+    @api.model
+    def attachment_path(self, attach):
+        '''Returns the full path of the attachment in the filestore,
+        or None if the attachment is stored in the database'''
+        if attach.store_fname:
+            path = self.env['ir.attachment']._full_path(attach.store_fname)
+            if os.path.isfile(path):
+                return path
+        return None
 
+    @api.multi
     def get_source_object_with_chatter(self):
         self.ensure_one()
-        src_obj = self.get_source_object()
-        if src_obj and hasattr(src_obj, 'message_post'):
-            return src_obj
-        else:
-            return None
+        return self.get_source_objects_with_chatter()[self.id]
 
     @api.model
     def yousign_init(self):
@@ -282,7 +469,11 @@ class YousignRequest(models.Model):
             'Content-Type': 'application/json',
             'Authorization': 'Bearer %s' % apikey,
         }
-        if environment == 'prod':
+        # yousign_url is only meant for tests, cf scripts/bench_yousign.py
+        url_base = tools.config.get('yousign_url')
+        if url_base:
+            url_base = url_base.rstrip('/')
+        elif environment == 'prod':
             url_base = 'https://api.yousign.com'
         else:
             url_base = 'https://staging-api.yousign.com'
@@ -290,62 +481,141 @@ class YousignRequest(models.Model):
         return (url_base, headers)
 
     @api.model
-    def yousign_request(
-            self, method, url, expected_status_code=201,
-            json=None, return_raw=False, raise_if_ko=True):
+    def yousign_timeouts(self):
+        '''Read the optional keys yousign_timeout_<endpoint class> of the
+        server config file. Value format: connect_timeout,read_timeout'''
+        timeouts = {}
+        for ep_class in DEFAULT_TIMEOUTS:
+            value = tools.config.get('yousign_timeout_%s' % ep_class)
+            if not value:
+                continue
+            try:
+                connect, read = [float(x) for x in str(value).split(',')]
+            except ValueError:
+                raise UserError(_(
+                    "Wrong value '%s' for the key yousign_timeout_%s in the "
+                    "Odoo server config file. It should be "
+                    "'connect_timeout,read_timeout' in seconds.")
+                    % (value, ep_class))
+            timeouts[ep_class] = (connect, read)
+        return timeouts
+
+    @api.model
+    def yousign_client(self):
         url_base, headers = self.yousign_init()
-        full_url = url_base + url
+        return get_client(
+            url_base, headers, timeouts=self.yousign_timeouts(),
+            pool_size=int(tools.config.get(
+                'yousign_pool_size', DEFAULT_POOL_SIZE)))
+
+    @api.model
+    def yousign_webhook_config(self):
+        '''If the key yousign_webhook_url is set in the server config file,
+        Yousign will call our webhook controller when a signatory signs or
+        when the procedure is finished or refused'''
+        url = tools.config.get('yousign_webhook_url')
+        if not url:
+            return {}
+        secret = tools.config.get('yousign_webhook_secret')
+        if not secret:
+            raise UserError(_(
+                "The key yousign_webhook_secret is missing in the Odoo "
+                "server config file."))
+        webhook = {
+            'url': url,
+            'method': 'POST',
+            'headers': {WEBHOOK_SECRET_HEADER: secret},
+            }
+        return dict([(event, [webhook]) for event in WEBHOOK_EVENTS])
+
+    @api.model
+    def process_webhook(self, payload):
+        '''Called by the webhook controller with the JSON sent by Yousign.
+        Only the request of the procedure is updated.'''
+        event = payload.get('eventName')
+        proc_res = payload.get('procedure') or {}
+        if not proc_res.get('id'):
+            logger.warning('Yousign webhook %s without procedure ID', event)
+            return False
+        req = self.search([
+            ('ys_identifier', '=', proc_res['id']),
+            ('state', '=', 'sent')], limit=1)
+        if not req:
+            logger.info(
+                'Yousign webhook %s: no sent request for procedure %s',
+                event, proc_res['id'])
+            return False
         logger.info(
-            'Sending %s request on %s. Expecting status code %d.',
-            method, full_url, expected_status_code)
-        logger.debug('JSON data sent: %s', json)
+            'Yousign webhook %s on YS req %s ID %d', event, req.name, req.id)
+        if not proc_res.get('members'):
+            proc_res = self.yousign_request(
+                'GET', req.ys_identifier, 200, raise_if_ko=False)
+            if proc_res is None:
+                return False
+        req.update_status_from_procedure(proc_res, raise_if_ko=False)
+        if req.state == 'signed':
+            req.archive(raise_if_ko=False)
+        return True
+
+    @api.model
+    def yousign_tracing(self):
+        '''Returns False, 'log' (the traces are logged) or 'store' (the
+        traces are also written on the requests)'''
+        mode = tools.config.get('yousign_tracing')
+        if mode in ('log', 'store'):
+            return mode
+        return False
+
+    @api.multi
+    def store_trace(self, trace):
+        '''Write the timeline of the trace on the requests, without
+        going through write(), so without mail tracking'''
+        self._cr.execute(
+            "UPDATE yousign_request SET trace_timeline=%s WHERE id IN %s",
+            (trace.timeline(), tuple(self.ids)))
+        self.invalidate_cache(['trace_timeline'], self.ids)
+
+    @api.model
+    def yousign_max_workers(self):
+        '''Max number of parallel requests to Yousign for one operation'''
+        return int(tools.config.get('yousign_max_workers', 4))
+
+    @api.model
+    def yousign_request(
+            self, method, url, expected_status_code=201,
+            json=None, return_raw=False, raise_if_ko=True, retry=None,
+            stream=False):
+        '''retry is a RetryPolicy (cf client.py). By default,
+        YousignClient.call() uses DEFAULT_RETRY. Give NO_RETRY to disable
+        retries.'''
+        client = self.yousign_client()
         try:
-            res = requests.request(
-                method, full_url, headers=headers, json=json, timeout=TIMEOUT)
-        except requests.exceptions.ConnectionError as e:
-            logger.error("Connection to %s failed. Error: %s", full_url, e)
+            return client.call(
+                method, url, expected_status_code, json=json,
+                return_raw=return_raw, stream=stream, retry=retry)
+        except YousignError as e:
             if raise_if_ko:
-                raise UserError(
-                    _(
-                        "Connection to %s failed. "
-                        "Check the Internet connection of the Odoo server.\n\n"
-                        "Error details: %s"
-                    ) % (full_url, e))
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.error("%s request %s failed. Error: %s", method, full_url, e)
-            if raise_if_ko:
-                raise UserError(
-                    _(
-                        "Technical failure when trying to connect to Yousign.\n\n"
-                        "Error details: URL %s method %s. Error: %s"
-                    )
-                    % (full_url, method, e))
-            return None
-        if res.status_code != expected_status_code:
-            logger.error('Status code received: %s.', res.status_code)
-            try:
-                res_json = res.json()
-            except Exception:
-                res_json = {}
-            logger.error(
-                "HTTP %s request on %s returned HTTP Code %s (%s was expected). "
-                "Error message: %s (%s).", method, full_url, res.status_code,
-                expected_status_code, res_json.get('title'),
-                res_json.get('detail', 'no detail'))
-            if raise_if_ko:
-                raise UserError(_(
-                    "The HTTP %s request on Yousign webservice %s returned status "
-                    "code %d whereas %d was expected. Error message: %s (%s).")
-                    % (method, full_url, res.status_code,
-                       expected_status_code, res_json.get('title'),
-                        res_json.get('detail', _('no detail'))))
+                raise UserError(self.yousign_error_message(e))
             return None
-        if return_raw:
-            return res
-        res_json = res.json()
-        logger.debug('JSON webservice answer: %s', res_json)
-        return res_json
+
+    @api.model
+    def yousign_error_message(self, error):
+        if error.kind == 'connection':
+            return _(
+                "Connection to %s failed. "
+                "Check the Internet connection of the Odoo server.\n\n"
+                "Error details: %s") % (error.url, error.error)
+        elif error.kind == 'technical':
+            return _(
+                "Technical failure when trying to connect to Yousign.\n\n"
+                "Error details: URL %s method %s. Error: %s") % (
+                error.url, error.method, error.error)
+        return _(
+            "The HTTP %s request on Yousign webservice %s returned status "
+            "code %d whereas %d was expected. Error message: %s (%s).") % (
+            error.method, error.url, error.status_code,
+            error.expected_status_code, error.title,
+            error.detail or _('no detail'))
 
     @api.multi
     def name_get(self):
@@ -384,27 +654,38 @@ class YousignRequest(models.Model):
         return text
 
     @api.model
-    def include_url_tag(self, mail_body, mail_name, raise_if_not_found=False):
+    def url_tag_error(self, mail_body, mail_name, required=False):
+        '''Returns the error message if the mail body is empty or if its
+        special tag for the Yousign URL is wrong or missing (when
+        required), otherwise False'''
         if not mail_body:
-            raise UserError(_(
-                "Mail body of %s is empty.") % mail_name)
-        regexp = '{yousignUrl\|.+}'
+            return _("Mail body of %s is empty.") % mail_name
+        if re.search(URL_TAG_REGEXP, mail_body, re.IGNORECASE):
+            return False
+        if required:
+            return _(
+                "Missing special tag {yousignUrl|Access to documents} "
+                "in the mail body of %s. The special tag will be replaced "
+                "by the button with the label "
+                "'Access to documents'.") % mail_name
+        elif 'yousignUrl' in mail_body:
+            return _(
+                "In mail body of %s, it seems you tried to "
+                "include the yousign URL, but the regular expression "
+                "didn't match. Please check the special expression "
+                "for the yousign URL.") % mail_name
+        return False
+
+    @api.model
+    def include_url_tag(self, mail_body, mail_name, raise_if_not_found=False):
+        error = self.url_tag_error(
+            mail_body, mail_name, required=raise_if_not_found)
+        if error:
+            raise UserError(error)
+        regexp = URL_TAG_REGEXP
         match = re.search(regexp, mail_body, re.IGNORECASE)
         if not match:
-            if raise_if_not_found:
-                raise UserError(_(
-                    "Missing special tag {yousignUrl|Access to documents} "
-                    "in the mail body of %s. The special tag will be replaced "
-                    "by the button with the label "
-                    "'Access to documents'.") % mail_name)
-            elif 'yousignUrl' in mail_body:
-                raise UserError(_(
-                    "In mail body of %s, it seems you tried to "
-                    "include the yousign URL, but the regular expression "
-                    "didn't match. Please check the special expression "
-                    "for the yousign URL.") % mail_name)
-            else:
-                return mail_body
+            return mail_body
         found = match.group(0)
         button_label = found.split('|')[1][:-1].strip()
         button_label_txt = self.simple_html2txt(button_label)
@@ -415,23 +696,92 @@ class YousignRequest(models.Model):
         return new_mail_body
 
     @api.multi
-    def send(self):
+    def preflight_check(self):
+        '''Checks the requests without any request to Yousign: signatories,
+        documents to sign and mail bodies. send() runs it first, so that
+        nothing is created on Yousign for a request that would be rejected.
+        Returns a dict with key = request ID, value = list of all the error
+        messages of the request (empty if the request can be sent).'''
+        ypio = self.env['yousign.pdf.info']
+        pdf_errors = {}  # key = attachment, value = error message or False
+        res = {}
+        for req in self:
+            errors = []
+            if not req.signatory_ids:
+                errors.append(_(
+                    "There are no signatories on request %s!")
+                    % req.display_name)
+            # the pending report will be rendered by send()
+            if not req.attachment_ids and not req.report_pending_id:
+                errors.append(_(
+                    "There are no documents to sign on request %s!")
+                    % req.display_name)
+            if not req.init_mail_subject:
+                errors.append(_(
+                    "Missing init mail subject on request %s.")
+                    % req.display_name)
+            if not req.init_mail_body:
+                errors.append(_(
+                    "Missing init mail body on request %s.")
+                    % req.display_name)
+            else:
+                errors.append(req.url_tag_error(
+                    req.init_mail_body, 'init', required=True))
+            for notif in req.notification_ids:
+                errors.append(req.url_tag_error(notif.body, notif.notif_type))
+            if req.remind_auto:
+                if not req.remind_mail_subject:
+                    errors.append(_("Missing Remind Mail Subject"))
+                if not req.remind_mail_body:
+                    errors.append(_("Missing Remind Mail Body"))
+                else:
+                    errors.append(req.url_tag_error(
+                        req.remind_mail_body, 'reminder', required=True))
+            for attach in req.attachment_ids:
+                # the same document is often shared by several requests
+                if attach not in pdf_errors:
+                    pdf_info = ypio.get_attachment_info(attach)
+                    pdf_errors[attach] = not pdf_info.valid and _(
+                        "File to sign '%s' is not a valid PDF file. You "
+                        "must convert it to PDF before including it in a "
+                        "Yousign request.\n\nError details: %s") % (
+                        attach.datas_fname or attach.name,
+                        pdf_info.error) or False
+                errors.append(pdf_errors[attach])
+            for signat in req.signatory_ids:
+                if not signat.lastname:
+                    errors.append(_(
+                        "Missing lastname on one of the signatories of "
+                        "request %s") % req.display_name)
+                    continue
+                if not signat.firstname:
+                    errors.append(_(
+                        "Missing firstname on signatory '%s'")
+                        % signat.lastname)
+                if not signat.email:
+                    errors.append(_(
+                        "Missing email on the signatory '%s'")
+                        % signat.lastname)
+                if not signat.mobile and signat.auth_mode == 'sms':
+                    errors.append(_(
+                        "Missing mobile phone number on signatory '%s'.")
+                        % signat.lastname)
+            res[req.id] = [error for error in errors if error]
+        return res
+
+    @api.multi
+    @traced('send')
+    def send(self, retry=None):
         self.ensure_one()
         logger.info('Start to send YS request %s ID %d', self.name, self.id)
-        if not self.signatory_ids:
-            raise UserError(_(
-                "There are no signatories on request %s!") % self.display_name)
-        if not self.attachment_ids:
-            raise UserError(_(
-                "There are no documents to sign on request %s!")
-                % self.display_name)
-        if not self.init_mail_subject:
-            raise UserError(_(
-                "Missing init mail subject on request %s.")
-                % self.display_name)
-        if not self.init_mail_body:
-            raise UserError(_(
-                "Missing init mail body on request %s.") % self.display_name)
+        if self.report_pending_id:
+            tracing.phase('report')
+            self.render_pending_reports()
+        tracing.phase('validate')
+        # nothing is sent to Yousign if one of the checks fails
+        errors = self.preflight_check()[self.id]
+        if errors:
+            raise UserError(u'\n'.join(errors))
         rank = 0
         init_mail_body = self.include_url_tag(
             self.init_mail_body, 'init', raise_if_not_found=True)
@@ -466,10 +816,6 @@ class YousignRequest(models.Model):
                 'to': to,
                 }]
         if self.remind_auto:
-            if not self.remind_mail_subject:
-                raise UserError(_("Missing Remind Mail Subject"))
-            if not self.remind_mail_body:
-                raise UserError(_("Missing Remind Mail Body"))
             remind_mail_body = self.include_url_tag(
                 self.remind_mail_body, 'reminder', raise_if_not_found=True)
             data['config']['reminders'] = [{
@@ -485,53 +831,32 @@ class YousignRequest(models.Model):
                         },
                     },
                 }]
-        rproc_res = self.yousign_request('POST', '/procedures', json=data)
-        if rproc_res.get('status') != 'draft':
-            raise UserError(_('Wrong status, should be draft'))
-        if not rproc_res.get('id'):
-            raise UserError(_('Missing ID'))
-        ys_id = rproc_res['id']
+        webhook_config = self.yousign_webhook_config()
+        if webhook_config:
+            data['config']['webhook'] = webhook_config
+        tracing.phase('pdf')
         attach_data = {}
         # key = attach recordset
-        # value = {'pagenum': 4, 'filename': 'tutu.pdf', 'ys_id': 'JLDKSJDKL'}
+        # value = {'num_pages': 4, 'filename': 'tutu.pdf', 'path': '/...'}
+        ypio = self.env['yousign.pdf.info']
         for attach in self.attachment_ids:
             # We decide to always add signature on last page
             filename = attach.datas_fname or attach.name
-            pdf_file = StringIO(attach.datas.decode('base64'))
-            try:
-                pdf = PyPDF2.PdfFileReader(pdf_file)
-            except PyPDF2.utils.PdfReadError:
-                raise UserError(_(
-                    "File to sign '%s' is not a valid PDF file. You "
-                    "must convert it to PDF before including it in a "
-                    "Yousign request.") % filename)
-            num_pages = pdf.getNumPages()
+            pdf_info = ypio.get_attachment_info(attach)
+            num_pages = pdf_info.num_pages
             logger.info('PDF %s has %d pages', filename, num_pages)
             attach_data[attach] = {
                 'filename': filename,
-                'base64': attach.datas,
+                'path': self.attachment_path(attach),
                 'num_pages': num_pages,
+                'checksum': pdf_info.checksum,
                 }
 
+        tracing.phase('prepare')
         members_data = {}
 
         for signat in self.signatory_ids:
             rank += 1
-            if not signat.lastname:
-                raise UserError(_(
-                    "Missing lastname on one of the signatories of request %s")
-                    % self.display_name)
-            if not signat.firstname:
-                raise UserError(_(
-                    "Missing firstname on signatory '%s'" % signat.lastname))
-            if not signat.email:
-                raise UserError(_(
-                    "Missing email on the signatory '%s'") % signat.lastname)
-
-            if not signat.mobile and signat.auth_mode == 'sms':
-                raise UserError(_(
-                    "Missing mobile phone number on signatory '%s'.")
-                    % signat.lastname)
             members_data[signat] = {
                 'firstname':
                 signat.firstname and signat.firstname.strip() or '',
@@ -544,23 +869,15 @@ class YousignRequest(models.Model):
                 'mention2': signat.mention_bottom or '',
                 }
 
-        for attach, attach_vals in attach_data.items():
-            json = {
-                'name': attach_vals['filename'],
-                'content': attach_vals['base64'],
-                'procedure': ys_id,
-                }
-            rattach_res = self.yousign_request('POST', '/files', json=json)
-            ys_attach_id = rattach_res.get('id')
-            assert ys_attach_id
-            attach_data[attach]['ys_attach_id'] = ys_attach_id
-
-        for member, member_vals in members_data.items():
+        # JSON of the objects to create on Yousign, without the procedure
+        member_jsons = {}
+        file_object_jsons = {}
+        for member in self.signatory_ids:
+            member_vals = members_data[member]
             json = {
                 'firstname': member_vals['firstname'],
                 'lastname': member_vals['lastname'],
                 'email': member_vals['email'],
-                'procedure': ys_id,
                 'operationLevel': "custom",
                 'operationCustomModes': [member.auth_mode],
                 }
@@ -570,39 +887,155 @@ class YousignRequest(models.Model):
                 json['phone'] = '+33699089246'
             if self.ordered:
                 json['position'] = member_vals['rank']
-            rmember_res = self.yousign_request('POST', '/members', json=json)
-            ys_member_id = rmember_res.get('id')
-            assert ys_member_id
-            members_data[member]['ys_member_id'] = ys_member_id
-            member.ys_identifier = ys_member_id
-
-            for attach_id, attach_vals in attach_data.items():
-                json_fo = {
-                    'file': attach_vals['ys_attach_id'],
-                    'member': ys_member_id,
+            member_jsons[member] = json
+            for attach, attach_vals in attach_data.items():
+                file_object_jsons[(member, attach)] = {
                     'page': attach_vals['num_pages'],
                     'position': self.signature_position(member_vals['rank']),
                     'mention': member_vals.get('mention'),
                     'mention2': member_vals.get('mention2'),
                     # 'reason': ,
                     }
-                self.yousign_request('POST', '/file_objects', json=json_fo)
+
+        # The objects created on Yousign are saved as checkpoints, so that
+        # a new call of send() after a failure continues from there
+        yrco = self.env['yousign.request.checkpoint']
+        fingerprints = {('procedure', ): yrco.fingerprint_of(data)}
+        for attach, attach_vals in attach_data.items():
+            fingerprints[('file', attach.id)] = yrco.fingerprint_of([
+                attach_vals['filename'], attach_vals['checksum']])
+        for member, json in member_jsons.items():
+            fingerprints[('member', member.id)] = yrco.fingerprint_of(json)
+        for (member, attach), json_fo in file_object_jsons.items():
+            fingerprints[('file_object', member.id, attach.id)] =\
+                yrco.fingerprint_of(json_fo)
+        client = self.yousign_client()
+        checkpoints = yrco.writer(self.id)
+        tracing.phase('checkpoints')
+        ys_id, done, started = self._send_load_checkpoints(
+            client, fingerprints, checkpoints, retry=retry)
+        if ys_id:
+            logger.info(
+                'Resuming the sending of YS request %s ID %d: %d objects '
+                'already created on procedure %s',
+                self.name, self.id, len(done), ys_id)
+        else:
+            tracing.phase('procedure')
+            rproc_res = self.yousign_request(
+                'POST', '/procedures', json=data, retry=retry)
+            if rproc_res.get('status') != 'draft':
+                raise UserError(_('Wrong status, should be draft'))
+            if not rproc_res.get('id'):
+                raise UserError(_('Missing ID'))
+            ys_id = rproc_res['id']
+            checkpoints.save(
+                ('procedure', ), ys_id, fingerprints[('procedure', )])
+            checkpoints.flush()
+
+        # The creation of files, members and file_objects is done in
+        # parallel: a file_object is created as soon as its file and its
+        # member exist on Yousign. The tasks run in worker threads, so
+        # they only use the HTTP client, not the ORM.
+
+        def checkpointed(ys_identifier):
+            return ys_identifier
+
+        def create_object(url, **kwargs):
+            res = client.call('POST', url, retry=retry, **kwargs)
+            assert res.get('id')
+            return res['id']
+
+        def create_file_object(json_fo, ys_member_id, ys_attach_id):
+            json_fo = dict(json_fo, member=ys_member_id, file=ys_attach_id)
+            return client.call(
+                'POST', '/file_objects', json=json_fo, retry=retry).get('id')
+
+        def add_task(key, func, **kwargs):
+            if key in done:
+                func = partial(checkpointed, done[key])
+                kwargs.pop('depends', None)
+            graph.add(key, func, **kwargs)
+
+        tracing.phase('objects')
+        graph = TaskGraph(max_workers=self.yousign_max_workers())
+        for attach, attach_vals in attach_data.items():
+            json = {
+                'name': attach_vals['filename'],
+                'procedure': ys_id,
+                }
+            if attach_vals['path']:
+                # stream the file from the filestore
+                kwargs = {'data': FileJSONBody(attach_vals['path'], json)}
+            else:
+                json['content'] = attach.datas
+                kwargs = {'json': json}
+            add_task(('file', attach.id), partial(
+                create_object, '/files', **kwargs))
+
+        previous_member_key = None
+        for member in self.signatory_ids:
+            json = dict(member_jsons[member], procedure=ys_id)
+            member_key = ('member', member.id)
+            after = ()
+            if self.ordered:
+                # keep the creation order of the members
+                if previous_member_key:
+                    after = (previous_member_key, )
+                previous_member_key = member_key
+            add_task(
+                member_key, partial(create_object, '/members', json=json),
+                after=after)
+
+            for attach in attach_data.keys():
+                add_task(
+                    ('file_object', member.id, attach.id),
+                    partial(
+                        create_file_object,
+                        file_object_jsons[(member, attach)]),
+                    depends=(member_key, ('file', attach.id)))
+
+        def save_checkpoint(key, ys_identifier):
+            if key not in done:
+                checkpoints.save(key, ys_identifier, fingerprints[key])
 
         try:
-            logger.debug('Start YS initSign on req ID %d', self.id)
-            self.yousign_request('PUT', ys_id, 200, json={'start': True})
-        except Exception as e:
-            err_msg = str(e).decode('utf-8')
-            logger.error(
-                'YS initSign failed on req ID %d with error %s',
-                self.id, err_msg)
-            raise UserError(_(
-                "Failure when sending the signing request %s to "
-                "Yousign.\n\n"
-                "Error: %s") % (self.display_name, err_msg))
+            ys_ids = graph.run(on_done=save_checkpoint)
+        except YousignError as e:
+            raise UserError(self.yousign_error_message(e))
+        finally:
+            # one transaction for the objects of the phase, also when a
+            # task failed: the objects created so far are kept
+            checkpoints.flush()
+        for member in self.signatory_ids:
+            member.ys_identifier = ys_ids[('member', member.id)]
+
+        if started:
+            logger.info(
+                'YS procedure %s of request ID %d was already started',
+                ys_id, self.id)
+        else:
+            tracing.phase('start')
+            try:
+                logger.debug('Start YS initSign on req ID %d', self.id)
+                self.yousign_request(
+                    'PUT', ys_id, 200, json={'start': True}, retry=retry)
+            except Exception as e:
+                err_msg = str(e).decode('utf-8')
+                logger.error(
+                    'YS initSign failed on req ID %d with error %s',
+                    self.id, err_msg)
+                raise UserError(_(
+                    "Failure when sending the signing request %s to "
+                    "Yousign.\n\n"
+                    "Error: %s") % (self.display_name, err_msg))
+        tracing.phase('write')
         self.write({
             'state': 'sent',
             'ys_identifier': ys_id,
+            'send_error': False,
+            'next_check_at': fields.Datetime.now(),
+            'unchanged_check_count': 0,
+            'check_failure_count': 0,
             })
         self.signatory_ids.write({'state': 'pending'})
         src_obj = self.get_source_object_with_chatter()
@@ -614,76 +1047,541 @@ class YousignRequest(models.Model):
         return
 
     @api.multi
-    def cancel(self):
+    def _send_load_checkpoints(
+            self, client, fingerprints, checkpoints, retry=None):
+        '''Returns (procedure ID, dict with key = checkpoint key and
+        value = Yousign ID of the objects already created, True if the
+        procedure is already started) from the checkpoints of a previous
+        send() that failed. If the request was modified since then, or if
+        the procedure on Yousign has objects that are not in the
+        checkpoints, the previous procedure is deleted and this method
+        returns (None, {}, False), so the sending starts over.
+        checkpoints is the CheckpointWriter of send().
+        retry=None means DEFAULT_RETRY, so a transient error of Yousign on
+        the GET of the procedure doesn't prevent the resume.'''
+        self.ensure_one()
+        yrco = self.env['yousign.request.checkpoint']
+        checkpoints = yrco.load(self.id)
+        if not checkpoints:
+            return None, {}, False
+        ys_id = checkpoints.get(('procedure', ), (None, None))[0]
+        done = dict([
+            (key, ys_identifier)
+            for (key, (ys_identifier, fingerprint)) in checkpoints.items()])
+        unchanged = all([
+            fingerprints.get(key) == fingerprint
+            for (key, (ys_identifier, fingerprint)) in checkpoints.items()])
+        if ys_id and unchanged:
+            try:
+                remote = client.call('GET', ys_id, 200, retry=retry)
+            except YousignError as e:
+                if e.status_code != 404:
+                    # we can't know if we can resume, try later
+                    raise UserError(self.yousign_error_message(e))
+                remote = None
+            if remote is not None:
+                remote_ids = set([
+                    x.get('id') for x in
+                    (remote.get('files') or []) +
+                    (remote.get('members') or [])])
+                started = remote.get('status') != 'draft'
+                if (
+                        remote_ids <= set(done.values()) and
+                        (not started or
+                         set(fingerprints.keys()) <= set(done.keys()))):
+                    return ys_id, done, started
+        logger.info(
+            'Checkpoints of YS request %s ID %d are obsolete: starting over',
+            self.name, self.id)
+        if ys_id:
+            # best effort: the previous procedure is not used any more
+            res, error = capture_errors(
+                client.call, 'DELETE', ys_id, 204, return_raw=True,
+                retry=retry)
+            if res is not None:
+                res.close()
+        checkpoints.clear()
+        return None, {}, False
+
+    @api.multi
+    def send_background(self):
+        '''Switch the requests to the Sending state: they will be sent to
+        Yousign by the cron "Yousign Requests Sending", so that the user
+        doesn't wait for the requests to Yousign'''
+        reqs = self.filtered(lambda x: x.state == 'draft')
+        # the requests that would fail stay in draft with their errors
+        errors = reqs.preflight_check()
+        invalid = reqs.filtered(lambda x: errors[x.id])
+        for req in invalid:
+            req.send_error = u'\n'.join(errors[req.id])
+        reqs -= invalid
+        reqs.write({'state': 'sending', 'send_error': False})
+        for req in reqs:
+            logger.info(
+                'YS request %s ID %d queued for sending', req.name, req.id)
+        if reqs:
+            self._trigger_send_cron()
+        return
+
+    @api.model
+    def _trigger_send_cron(self):
+        '''Start the sending cron at the next check of the cron scheduler
+        of Odoo, instead of waiting for its next planned execution'''
+        cron = self.env.ref(
+            'yousign_connector.cron_yousign_send', raise_if_not_found=False)
+        if not cron:
+            return
+        now = fields.Datetime.now()
+        try:
+            with self._cr.savepoint():
+                # if the cron is running, it will process the new requests
+                self._cr.execute(
+                    "SELECT id FROM ir_cron WHERE id=%s FOR UPDATE NOWAIT",
+                    (cron.id, ))
+                self._cr.execute(
+                    "UPDATE ir_cron SET nextcall=%s "
+                    "WHERE id=%s AND active AND nextcall > %s",
+                    (now, cron.id, now))
+        except psycopg2.OperationalError:
+            logger.debug('Yousign sending cron is running')
+
+    @api.model
+    def cron_send(self, time_budget=None):
+        '''Send the requests in Sending state, one by one, each one being
+        committed. The request is locked with SELECT ... FOR UPDATE SKIP
+        LOCKED, so several crons can run at the same time.'''
+        start = time.time()
+        last_id = 0
+        count = 0
+        while True:
+            if time_budget and time.time() - start > time_budget:
+                logger.info(
+                    'Yousign sending cron stopped: time budget of %s '
+                    'seconds exhausted', time_budget)
+                break
+            self._cr.execute(
+                "SELECT id FROM yousign_request WHERE state='sending' "
+                "AND id > %s ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED",
+                (last_id, ))
+            row = self._cr.fetchone()
+            if not row:
+                break
+            last_id = row[0]
+            req = self.browse(last_id)
+            send_start = time.time()
+            try:
+                req.send(retry=CRON_RETRY)
+                req.message_post(_("Request sent to Yousign."))
+                self._cr.commit()
+                count += 1
+                metrics.observe(
+                    'yousign_cron_batch_duration_seconds',
+                    time.time() - send_start, {'stage': 'send'})
+            except Exception as e:
+                self._cr.rollback()
+                self.invalidate_cache()
+                logger.exception(
+                    'Yousign sending cron: failed to send request ID %d',
+                    last_id)
+                err_msg = tools.ustr(e)
+                self._send_failed(req, err_msg)
+        logger.info(
+            'Yousign sending cron: %d request(s) sent in %d seconds',
+            count, time.time() - start)
+        self.env['yousign.metric'].flush()
+        self._cron_render_draft_reports(start, time_budget)
+
+    @api.model
+    def _cron_render_draft_reports(self, start, time_budget=None):
+        '''Called by cron_send(): render the reports of the draft requests
+        created by the bulk wizard without sending them (cf
+        prepare_from_template(defer_report=True)), one request per
+        transaction. A request whose rendering failed gets a sending error
+        and is left for send(), which renders it again.'''
+        last_id = 0
+        count = 0
+        while not (time_budget and time.time() - start > time_budget):
+            self._cr.execute(
+                "SELECT id FROM yousign_request WHERE state='draft' "
+                "AND report_pending_id IS NOT NULL AND send_error IS NULL "
+                "AND id > %s ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED",
+                (last_id, ))
+            row = self._cr.fetchone()
+            if not row:
+                break
+            last_id = row[0]
+            req = self.browse(last_id)
+            try:
+                req.render_pending_reports()
+                self._cr.commit()
+                count += 1
+            except Exception as e:
+                self._cr.rollback()
+                self.invalidate_cache()
+                logger.exception(
+                    'Yousign sending cron: failed to render the report of '
+                    'request ID %d', last_id)
+                req.write({'send_error': tools.ustr(e)})
+                self._cr.commit()
+        if count:
+            logger.info(
+                'Yousign sending cron: reports of %d draft request(s) '
+                'rendered', count)
+
+    @api.model
+    def _send_failed(self, req, err_msg):
+        '''Called by cron_send() after the rollback of a failed sending,
+        so the lock on the request is gone: we lock it again and put it
+        back in draft only if it is still in Sending state (it may have
+        been cancelled in the meantime). A failure here doesn't stop the
+        cron: the request stays in Sending state until the next run.'''
+        try:
+            self._cr.execute(
+                "SELECT id FROM yousign_request "
+                "WHERE id=%s AND state='sending' FOR UPDATE", (req.id, ))
+            if not self._cr.fetchone():
+                logger.info(
+                    'Yousign sending cron: request ID %d is not in Sending '
+                    'state any more, so it is not reset to draft', req.id)
+                self._cr.rollback()
+                return
+            req.write({'state': 'draft', 'send_error': err_msg})
+            req.message_post(_(
+                "Failed to send the request to Yousign:<br/>%s") % err_msg)
+            self._cr.commit()
+        except Exception:
+            self._cr.rollback()
+            self.invalidate_cache()
+            logger.exception(
+                'Yousign sending cron: failed to reset request ID %d to '
+                'draft', req.id)
+
+    @api.multi
+    def cancel(self, retry=None):
+        if self.ids:
+            # a request being sent is locked by cron_send(): don't make the
+            # user wait until the end of the sending
+            try:
+                with self._cr.savepoint():
+                    self._cr.execute(
+                        "SELECT id FROM yousign_request WHERE id IN %s "
+                        "FOR UPDATE NOWAIT", (tuple(self.ids), ))
+            except psycopg2.OperationalError:
+                raise UserError(_(
+                    "The Yousign request is being sent to Yousign. Please "
+                    "retry in a few minutes."))
+            self.invalidate_cache(['state', 'ys_identifier'], self.ids)
         for req in self:
             if req.state == 'sent' and req.ys_identifier:
                 self.yousign_request(
-                    'DELETE', req.ys_identifier, 204, return_raw=True)
+                    'DELETE', req.ys_identifier, 204, return_raw=True,
+                    retry=retry)
                 logger.info(
                     'Yousign request %s ID %s successfully cancelled.',
                     req.name, req.id)
                 req.message_post(_(
                     "Request successfully cancelled via Yousign "
                     "webservices."))
-        self.write({'state': 'cancel'})
+        self.write({'state': 'cancel', 'next_check_at': False})
 
     @api.multi
-    def update_status(self, raise_if_ko=True):
-        now = fields.Datetime.now()
+    def remind_members(self):
+        '''Returns the signatories who should receive a reminder: the
+        pending signatories, or only the first one if the signatories sign
+        one after the other'''
+        self.ensure_one()
+        members = self.signatory_ids.filtered(
+            lambda x: x.state == 'pending' and x.ys_identifier)
+        if self.ordered:
+            members = members[:1]
+        return members
+
+    @api.multi
+    def remind(self, retry=None):
+        '''Ask Yousign to send a reminder to the pending signatories of the
+        requests. The requests to Yousign are sent in parallel; a failure
+        doesn't stop the other reminders. Posts a message on each request.
+        retry=None means DEFAULT_RETRY: the HTTP 429 answers of Yousign
+        are retried after the delay of their Retry-After header.
+        Returns a dict with key = request ID, value = error message, or
+        False if the reminder was sent.'''
+        client = self.yousign_client()
+
+        def post_reminder(url):
+            # give the connection back to the pool of the client
+            client.call('POST', url, 201, return_raw=True, retry=retry)\
+                .close()
+
+        res = {}
+        to_remind = []  # list of (req, members)
+        graph = TaskGraph(max_workers=self.yousign_max_workers())
+        for req in self:
+            if (
+                    req.state != 'sent' or not req.ys_identifier or
+                    not req.ys_identifier.startswith('/procedures/')):
+                res[req.id] = _("The request is not in Sent state.")
+                continue
+            members = req.remind_members()
+            if not members:
+                res[req.id] = _("No pending signatory.")
+                continue
+            to_remind.append((req, members))
+            for member in members:
+                graph.add((req.id, member.id), partial(
+                    capture_errors, post_reminder,
+                    member.ys_identifier + '/reminders'))
+        results = graph.run()
+        for req, members in to_remind:
+            reminded = []
+            errors = []
+            for member in members:
+                dummy, error = results[(req.id, member.id)]
+                name = u' '.join(filter(None, [
+                    member.firstname, member.lastname]))
+                if error is None:
+                    reminded.append(name)
+                    continue
+                if isinstance(error, YousignError):
+                    error = self.yousign_error_message(error)
+                errors.append(u'%s: %s' % (name, tools.ustr(error)))
+            if reminded:
+                req.message_post(_(
+                    "Reminder sent via Yousign webservices to %s.")
+                    % u', '.join(reminded))
+            if errors:
+                logger.warning(
+                    'Failed to remind Yousign request %s ID %d: %s',
+                    req.name, req.id, errors)
+                res[req.id] = u'\n'.join(errors)
+                req.message_post(_(
+                    "Failed to send the reminder via Yousign webservices:"
+                    "<br/>%s") % u'<br/>'.join(errors))
+            else:
+                res[req.id] = False
+        return res
+
+    @api.multi
+    @traced('update_status')
+    def update_status(self, raise_if_ko=True, retry=None):
+        tracing.phase('sources')
+        reqs = self.filtered(lambda x: x.state == 'sent')
+        sources = reqs.get_source_objects_with_chatter()
+        # the writes of all the requests are done at the end
+        batch = self._new_status_batch()
+        for req in reqs:
+            logger.info(
+                'Start getInfosFromSignatureDemand request on YS req %s ID %d',
+                req.name, req.id)
+            tracing.phase('get')
+            # The procedure embeds the status of its members, so we only
+            # do one GET per procedure
+            proc_res = self.yousign_request(
+                'GET', req.ys_identifier, 200, raise_if_ko=raise_if_ko,
+                retry=retry)
+            if proc_res is None:
+                logger.warning('Skipping YS req %s ID %d', req.name, req.id)
+                batch['schedules'][req] = (
+                    False, req._prepare_next_check(failed=True))
+                continue
+            tracing.phase('sync')
+            req.update_status_from_procedure(
+                proc_res, raise_if_ko=raise_if_ko, retry=retry,
+                src_obj=sources[req.id], batch=batch)
+        tracing.phase('write')
+        self._flush_status_batch(batch)
+
+    @api.model
+    def _new_status_batch(self):
+        return {
+            # key = signatory, value = values to write
+            'signatories': {},
+            # key = request, value = values to write, except scheduling
+            'requests': {},
+            # key = request, value = (last_update or False,
+            # values of _prepare_next_check())
+            'schedules': {},
+            # list of (request, source object with chatter)
+            'signed': [],
+            }
+
+    @api.multi
+    def update_status_from_procedure(
+            self, proc_res, raise_if_ko=True, retry=None, src_obj=False,
+            batch=None):
+        '''proc_res is the procedure returned by the Yousign webservice
+        or sent by a Yousign webhook. We fallback to one GET per member
+        for the members that are not in the procedure.
+        src_obj is the result of get_source_object_with_chatter(), when
+        the caller already has it.
+        Only the values that changed are written. When batch is given
+        (cf _new_status_batch()), the writes are added to it and the
+        caller must call _flush_status_batch(); otherwise they are done
+        right away.'''
+        self.ensure_one()
+        flush = batch is None
+        if flush:
+            batch = self._new_status_batch()
         ystate2ostate = {
             'pending': 'pending',
             'processing': 'pending',
             'done': 'signed',
             'refused': 'refused',
             }
-        for req in self.filtered(lambda x: x.state == 'sent'):
-            logger.info(
-                'Start getInfosFromSignatureDemand request on YS req %s ID %d',
-                req.name, req.id)
-            sign_state = {}  # key = member, value = state
-            for signer in req.signatory_ids:
-                sign_state[signer] = 'draft'  # initialize
-                if not signer.ys_identifier:
-                    logger.warning(
-                        'Signer ID %s has no YS identifier', signer.id)
-                    continue
+        ys_members = dict([
+            (member['id'], member)
+            for member in proc_res.get('members') or []
+            if member.get('id')])
+        sign_state = {}  # key = member, value = state
+        changed = False
+        for signer in self.signatory_ids:
+            sign_state[signer] = 'draft'  # initialize
+            if not signer.ys_identifier:
+                logger.warning(
+                    'Signer ID %s has no YS identifier', signer.id)
+                continue
+            res = ys_members.get(signer.ys_identifier)
+            if res is None:
                 res = self.yousign_request(
-                    'GET', signer.ys_identifier, 200, raise_if_ko=raise_if_ko)
-                if res is None:
-                    logger.warning('Skipping YS req %s ID %d', req.name, req.id)
-                    continue
-                ystate = res.get('status')
-                if ystate not in ystate2ostate:
-                    logger.warning(
-                        'Bad state value for member ID %d: %s',
-                        signer.id, ystate)
-                    continue
-                ostate = ystate2ostate[ystate]
-                sign_state[signer] = ostate
-                signature_date = False
-                if ostate == 'signed':
-                    # TODO: take into account timezone
-                    # shouldn't we convert this field to datetime ?
-                    signature_date = res.get('finishedAt', '')[:10]
-                signer.write({
-                    'state': ostate,
-                    'signature_date': signature_date,
-                    'comment': res.get('comment', False),
-                    })
-
-            vals = {'last_update': now}
-            if all([x == 'signed' for x in sign_state.values()]):
-                vals['state'] = 'signed'
-                logger.info(
-                    'Yousign request %s switched to signed state', req.name)
-                src_obj = req.get_source_object_with_chatter()
-                if src_obj:
-                    # for v10, add link to request in message
-                    src_obj.suspend_security().message_post(_(
-                        "Yousign request <b>%s</b> has been signed by all "
-                        "signatories") % req.name)
-                    req.signed_hook(src_obj)
-            req.write(vals)
+                    'GET', signer.ys_identifier, 200,
+                    raise_if_ko=raise_if_ko, retry=retry)
+            if res is None:
+                logger.warning(
+                    'Skipping YS req %s ID %d', self.name, self.id)
+                continue
+            ystate = res.get('status')
+            if ystate not in ystate2ostate:
+                logger.warning(
+                    'Bad state value for member ID %d: %s',
+                    signer.id, ystate)
+                continue
+            ostate = ystate2ostate[ystate]
+            sign_state[signer] = ostate
+            signature_date = False
+            if ostate == 'signed':
+                # TODO: take into account timezone
+                # shouldn't we convert this field to datetime ?
+                signature_date = (res.get('finishedAt') or '')[:10] or False
+            if signer.state != ostate:
+                changed = True
+            signer_vals = {
+                'state': ostate,
+                'signature_date': signature_date,
+                'comment': res.get('comment') or False,
+                }
+            signer_vals = dict([
+                (key, value) for (key, value) in signer_vals.items()
+                if (signer[key] or False) != value])
+            if signer_vals:
+                batch['signatories'][signer] = signer_vals
+
+        last_update = fields.Datetime.now()
+        schedule = self._prepare_next_check(changed=changed)
+        if proc_res.get('status') == 'expired':
+            logger.info(
+                'Yousign request %s has expired: no more status checks',
+                self.name)
+            schedule['next_check_at'] = False
+        if all([x == 'signed' for x in sign_state.values()]):
+            batch['requests'][self] = {'state': 'signed'}
+            # archive as soon as possible
+            schedule = {
+                'next_check_at': last_update,
+                'unchanged_check_count': 0,
+                'check_failure_count': 0,
+                }
+            logger.info(
+                'Yousign request %s switched to signed state', self.name)
+            if src_obj is False:
+                src_obj = self.get_source_object_with_chatter()
+            batch['signed'].append((self, src_obj))
+        batch['schedules'][self] = (last_update, schedule)
+        if flush:
+            self._flush_status_batch(batch)
+
+    @api.model
+    def _flush_status_batch(self, batch):
+        '''Write the changes collected by update_status_from_procedure():
+        one write() per group of signatories or requests with the same
+        values, and one UPDATE query for the scheduling fields of all the
+        requests (they are not tracked, so write() is not needed)'''
+        ysro = self.env['yousign.request.signatory']
+        for vals, signers in self._group_by_values(batch['signatories']):
+            ysro.browse([x.id for x in signers]).write(vals)
+        for req, src_obj in batch['signed']:
+            if src_obj:
+                # for v10, add link to request in message
+                src_obj.suspend_security().message_post(_(
+                    "Yousign request <b>%s</b> has been signed by all "
+                    "signatories") % req.name)
+                req.signed_hook(src_obj)
+        for vals, reqs in self._group_by_values(batch['requests']):
+            self.browse([x.id for x in reqs]).write(vals)
+        if not batch['schedules']:
+            return
+        rows = []
+        params = []
+        for req, (last_update, vals) in batch['schedules'].items():
+            rows.append('(%s, %s::timestamp, %s::timestamp, %s, %s)')
+            params += [
+                req.id,
+                last_update or None,
+                vals['next_check_at'] or None,
+                vals.get('unchanged_check_count', req.unchanged_check_count),
+                vals.get('check_failure_count', req.check_failure_count),
+                ]
+        self._cr.execute(
+            "UPDATE yousign_request r SET "
+            "last_update=COALESCE(v.last_update, r.last_update), "
+            "next_check_at=v.next_check_at, "
+            "unchanged_check_count=v.unchanged_check_count, "
+            "check_failure_count=v.check_failure_count "
+            "FROM (VALUES %s) AS v(id, last_update, next_check_at, "
+            "unchanged_check_count, check_failure_count) "
+            "WHERE r.id=v.id" % ', '.join(rows), tuple(params))
+        self.invalidate_cache([
+            'last_update', 'next_check_at', 'unchanged_check_count',
+            'check_failure_count'],
+            [req.id for req in batch['schedules']])
+
+    @api.model
+    def _group_by_values(self, vals_by_record):
+        '''Returns a list of (vals, list of records with these vals)'''
+        groups = {}
+        for record, vals in vals_by_record.items():
+            key = tuple(sorted(vals.items()))
+            groups.setdefault(key, []).append(record)
+        return [(dict(key), records) for (key, records) in groups.items()]
+
+    @api.multi
+    def _prepare_next_check(self, changed=False, failed=False):
+        '''Returns the values to write on the request to schedule the next
+        check by the cron'''
+        self.ensure_one()
+        now = datetime.now()
+        create_date = fields.Datetime.from_string(self.create_date) or now
+        age_days = (now - create_date).days
+        if age_days > POLL_MAX_AGE_DAYS:
+            return {'next_check_at': False}
+        if changed:
+            unchanged_count = failure_count = 0
+        elif failed:
+            unchanged_count = self.unchanged_check_count
+            failure_count = self.check_failure_count + 1
+        else:
+            unchanged_count = self.unchanged_check_count + 1
+            failure_count = 0
+        for max_age, hours in POLL_BASE_HOURS:
+            if max_age is None or age_days < max_age:
+                break
+        hours = min(
+            hours * 2 ** min(unchanged_count + failure_count, 10),
+            POLL_MAX_HOURS)
+        return {
+            'next_check_at': fields.Datetime.to_string(
+                now + timedelta(hours=hours)),
+            'unchanged_check_count': unchanged_count,
+            'check_failure_count': failure_count,
+            }
 
     @api.multi
     def signed_hook(self, source_recordset):
@@ -692,90 +1590,376 @@ class YousignRequest(models.Model):
         return
 
     @api.model
-    def cron_update(self):
+    def cron_update(
+            self, batch_size=50, time_budget=None, shard=0, shard_count=1,
+            company_id=None):
+        '''The requests are claimed by batches with SELECT ... FOR UPDATE
+        SKIP LOCKED and each batch is committed, so several crons can run
+        at the same time. To split the work between several crons, give
+        each of them a different shard (0 <= shard < shard_count) or
+        company_id. time_budget is the max duration of the cron in
+        seconds.'''
+        start = time.time()
+        run_start = fields.Datetime.now()
+        stages = [('sent', 'update_status'), ('signed', 'archive')]
+        for state, method in stages:
+            last_id = 0
+            while True:
+                if time_budget and time.time() - start > time_budget:
+                    logger.info(
+                        'Yousign cron stopped: time budget of %s seconds '
+                        'exhausted', time_budget)
+                    return
+                ids = self._cron_claim_batch(
+                    state, last_id, batch_size, run_start, shard,
+                    shard_count, company_id)
+                if not ids:
+                    break
+                last_id = ids[-1]
+                batch_start = time.time()
+                self._cron_process_batch(ids, method)
+                metrics.observe(
+                    'yousign_cron_batch_duration_seconds',
+                    time.time() - batch_start, {'stage': method})
+                self.env['yousign.metric'].flush()
+        logger.info(
+            'Yousign cron finished in %d seconds', time.time() - start)
+
+    @api.model
+    def metrics_gauges(self):
+        '''Gauges of the metrics endpoint, computed from the database.
+        Returns a list of (name, labels dict, value).'''
+        self._cr.execute(
+            "SELECT state, count(*) FROM yousign_request GROUP BY state")
+        res = [
+            ('yousign_requests', {'state': state}, count)
+            for (state, count) in self._cr.fetchall()]
+        self._cr.execute(
+            "SELECT state, count(*) FROM yousign_request "
+            "WHERE state IN ('sent', 'signed') "
+            "AND ys_identifier LIKE '/procedures/%%' "
+            "AND next_check_at <= %s GROUP BY state",
+            (fields.Datetime.now(), ))
+        res += [
+            ('yousign_requests_due', {'state': state}, count)
+            for (state, count) in self._cr.fetchall()]
+        return res
+
+    @api.model
+    def _cron_claim_batch(
+            self, state, last_id, batch_size, run_start, shard=0,
+            shard_count=1, company_id=None):
         # Filter-out the YS requests of the old-API plateform
-        domain_base = [('ys_identifier', '=like', '/procedures/%')]
-        requests_to_update = self.search(
-            domain_base + [('state', '=', 'sent')])
-        requests_to_update.update_status(raise_if_ko=False)
-        requests_to_archive = self.search(
-            domain_base + [('state', '=', 'signed')])
-        requests_to_archive.archive(raise_if_ko=False)
+        query = """
+            SELECT id FROM yousign_request
+            WHERE state=%s AND ys_identifier LIKE '/procedures/%%'
+            AND next_check_at <= %s
+            AND id > %s AND id %% %s = %s"""
+        params = [
+            state, fields.Datetime.now(), last_id, shard_count, shard]
+        if state == 'sent':
+            # skip the requests updated by another cron during this run
+            query += " AND (last_update IS NULL OR last_update < %s)"
+            params.append(run_start)
+        if company_id:
+            query += " AND company_id=%s"
+            params.append(company_id)
+        query += " ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED"
+        params.append(batch_size)
+        self._cr.execute(query, tuple(params))
+        return [row[0] for row in self._cr.fetchall()]
+
+    @api.model
+    def _cron_process_batch(self, ids, method):
+        try:
+            getattr(self.browse(ids), method)(
+                raise_if_ko=False, retry=CRON_RETRY)
+            self._cr.commit()
+            return
+        except Exception:
+            self._cr.rollback()
+            self.invalidate_cache()
+            logger.exception(
+                'Yousign cron: %s failed on batch of request IDs %s. '
+                'Retrying one by one.', method, ids)
+        for req_id in ids:
+            self._cr.execute(
+                "SELECT id FROM yousign_request WHERE id=%s "
+                "FOR UPDATE SKIP LOCKED", (req_id, ))
+            if not self._cr.fetchone():
+                continue
+            try:
+                getattr(self.browse(req_id), method)(
+                    raise_if_ko=False, retry=CRON_RETRY)
+                self._cr.commit()
+            except Exception:
+                self._cr.rollback()
+                self.invalidate_cache()
+                logger.exception(
+                    'Yousign cron: %s failed on request ID %d', method, req_id)
+
+    @api.model
+    def _orphan_attachment_query(self):
+        '''Attachments of the Yousign requests that are not linked to any
+        live request: reports rendered by the wizard when it was discarded,
+        documents of deleted requests and of the requests cancelled before
+        being sent (state cancel without Yousign ID). The reports of the
+        report cache are kept as long as their cache entry.'''
+        docs_field = self._fields['attachment_ids']
+        signed_field = self._fields['signed_attachment_ids']
+        return """
+            SELECT a.id, a.file_size FROM ir_attachment a
+            WHERE a.res_model = %%s AND a.create_date < %%s AND a.id > %%s
+            AND (a.res_id IS NULL OR a.res_id = 0 OR NOT EXISTS (
+                SELECT 1 FROM yousign_request r WHERE r.id = a.res_id
+                AND NOT (r.state = 'cancel'
+                    AND COALESCE(r.ys_identifier, '') = '')))
+            AND NOT EXISTS (
+                SELECT 1 FROM %s d
+                JOIN yousign_request r ON r.id = d.%s
+                WHERE d.%s = a.id
+                AND NOT (r.state = 'cancel'
+                    AND COALESCE(r.ys_identifier, '') = ''))
+            AND NOT EXISTS (
+                SELECT 1 FROM %s s WHERE s.%s = a.id)
+            AND NOT EXISTS (
+                SELECT 1 FROM yousign_report_cache c
+                WHERE c.attachment_id = a.id)
+            ORDER BY a.id LIMIT %%s""" % (
+            docs_field.relation, docs_field.column1, docs_field.column2,
+            signed_field.relation, signed_field.column2)
+
+    @api.model
+    def cron_purge_orphan_attachments(
+            self, grace_hours=48, batch_size=500, dry_run=False,
+            cache_days=30):
+        '''Delete the orphan attachments of the Yousign requests created
+        more than grace_hours ago, by batches of batch_size attachments,
+        each batch being committed. With dry_run=True, nothing is deleted:
+        it only logs the number and the size of the orphan attachments.
+        The entries of the report cache unused for cache_days are deleted
+        first, so that their reports are purged as orphan attachments.
+        Also deletes the checkpoints of the requests that are sent.
+        Returns a dict with the keys count and size (in bytes).'''
+        if not dry_run:
+            self.env['yousign.report.cache'].purge(cache_days)
+            self._cr.commit()
+        limit_date = fields.Datetime.to_string(
+            datetime.now() - timedelta(hours=grace_hours))
+        query = self._orphan_attachment_query()
+        iao = self.env['ir.attachment'].sudo()
+        res = {'count': 0, 'size': 0}
+        last_id = 0
+        while True:
+            self._cr.execute(
+                query, (self._name, limit_date, last_id, batch_size))
+            rows = self._cr.fetchall()
+            if not rows:
+                break
+            attach_ids = [row[0] for row in rows]
+            last_id = attach_ids[-1]
+            res['count'] += len(rows)
+            res['size'] += sum([row[1] or 0 for row in rows])
+            if dry_run:
+                continue
+            try:
+                iao.browse(attach_ids).unlink()
+                self._cr.commit()
+            except Exception:
+                self._cr.rollback()
+                self.invalidate_cache()
+                logger.exception(
+                    'Yousign purge: failed to delete attachment IDs %s',
+                    attach_ids)
+        if not dry_run:
+            self.env['yousign.request.checkpoint'].purge()
+            self._cr.commit()
+        logger.info(
+            'Yousign purge%s: %d orphan attachments, %d bytes',
+            dry_run and ' (dry run)' or '', res['count'], res['size'])
+        return res
+
+    @api.model
+    def store_signed_file(self, tmp_path, file_size, checksum, vals):
+        '''Create the attachment from a file downloaded in a temporary
+        file of the filestore (cf download_to_tempfile()), so that the
+        signed file is never fully loaded in memory'''
+        iao = self.env['ir.attachment']
+        try:
+            if iao._storage() != 'file':
+                with open(tmp_path, 'rb') as tmp_file:
+                    vals['datas'] = tmp_file.read().encode('base64')
+                return iao.create(vals)
+            # same naming scheme as ir.attachment._get_path()
+            fname = '%s/%s' % (checksum[:3], checksum)
+            full_path = iao._full_path(fname)
+            if not os.path.isfile(full_path):
+                fname = '%s/%s' % (checksum[:2], checksum)
+                full_path = iao._full_path(fname)
+                if not os.path.isdir(os.path.dirname(full_path)):
+                    os.makedirs(os.path.dirname(full_path))
+                if not os.path.isfile(full_path):
+                    os.rename(tmp_path, full_path)
+            vals['store_fname'] = fname
+            attach = iao.create(vals)
+            # file_size is dropped by ir.attachment.create()
+            self._cr.execute(
+                "UPDATE ir_attachment SET file_size=%s WHERE id=%s",
+                (file_size, attach.id))
+            attach.invalidate_cache(['file_size'], attach.ids)
+            return attach
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @api.model
+    def yousign_download_max_bytes(self):
+        '''Max number of bytes downloaded at the same time by archive()'''
+        return int(tools.config.get(
+            'yousign_download_max_bytes', 200 * 1024 * 1024))
+
+    @api.multi
+    def _archive_failure(self, error, raise_if_ko, msg):
+        self.ensure_one()
+        if raise_if_ko:
+            if isinstance(error, YousignError):
+                raise UserError(self.yousign_error_message(error))
+            raise UserError(_(
+                "Failed to download the signed files of Yousign request "
+                "%s.\n\nError details: %s") % (self.name, error))
+        logger.warning(msg, self.name, self.id)
 
     @api.multi
-    def archive(self, raise_if_ko=True):
-        for req in self.filtered(
-                lambda x: x.state == 'signed' and x.ys_identifier):
+    @traced('archive')
+    def archive(self, raise_if_ko=True, retry=None):
+        # The HTTP requests are sent in parallel by worker threads, which
+        # don't use the ORM. The signed files are streamed to temporary
+        # files in the filestore. The attachments are created afterwards
+        # in the main thread.
+        # retry=None means DEFAULT_RETRY for the GET of the procedures and
+        # for the downloads (button Archive, webhook); the cron gives
+        # CRON_RETRY.
+        tracing.phase('procedures')
+        client = self.yousign_client()
+        max_workers = self.yousign_max_workers()
+        reqs = self.filtered(
+            lambda x: x.state == 'signed' and x.ys_identifier)
+        for req in reqs.filtered(lambda x: not x.attachment_ids):
+            logger.warning(
+                "Skip Yousign request %s ID %s: no documents to sign, "
+                "so nothing to archive", req.name, req.id)
+            # it will never be archived, so the cron can forget it
+            req.next_check_at = False
+
+        graph = TaskGraph(max_workers=max_workers)
+        for req in reqs:
             logger.info(
                 "Getting signed files on Yousign request %s ID %s",
                 req.name, req.id)
-            docs_to_sign_count = len(req.attachment_ids)
-            if not docs_to_sign_count:
-                logger.warning(
-                    "Skip Yousign request %s ID %s: no documents to sign, "
-                    "so nothing to archive", req.name, req.id)
+            graph.add(req.id, partial(
+                capture_errors, client.call, 'GET', req.ys_identifier, 200,
+                retry=retry))
+        proc_results = graph.run()
 
-            res = self.yousign_request(
-                'GET', req.ys_identifier, 200, raise_if_ko=raise_if_ko)
-            if res is None:
-                logger.warning("Skipping Yousign request %s ID %s", req.name, req.id)
+        to_download = []  # list of (req, file_id, signed_filename)
+        new_signed = {}  # key = req, value = number of new signed files
+        for req in reqs:
+            docs_to_sign_count = len(req.attachment_ids)
+            res, error = proc_results[req.id]
+            if error:
+                req._archive_failure(
+                    error, raise_if_ko, "Skipping Yousign request %s ID %s")
+                if docs_to_sign_count:
+                    req.write(req._prepare_next_check(failed=True))
                 continue
             if not res.get('files'):
+                if docs_to_sign_count:
+                    req.write(req._prepare_next_check())
                 continue
             signed_filenames = [
                 att.datas_fname for att in req.signed_attachment_ids]
-            if req.res_id and req.model:
-                res_model = req.model
-                res_id = req.res_id
-            else:
-                res_model = self._name
-                res_id = req.id
-
+            new_signed[req] = 0
             for sfile in res['files']:
                 file_id = sfile.get('id')
-                if file_id:
-                    dl = self.yousign_request(
-                        'GET', file_id + '/download', 200, return_raw=True,
-                        raise_if_ko=raise_if_ko)
-                    if dl is None:
-                        logger.warning(
-                            "Skipping Yousign request %s ID %s due to download failure",
-                            req.name, req.id)
-                        continue
-                    original_filename = sfile.get('name')
+                original_filename = sfile.get('name')
+                logger.debug("original_filename=%s", original_filename)
+                if not file_id or not original_filename:
+                    continue
+                if (
+                        original_filename[-4:] and
+                        original_filename[-4:].lower() == '.pdf'):
+                    signed_filename = '%s_signed.pdf' % original_filename[:-4]
+                else:
+                    signed_filename = original_filename
+                if signed_filename in signed_filenames:
                     logger.debug(
-                        "original_filename=%s", original_filename)
-                    if original_filename:
-                        if (
-                                original_filename[-4:] and
-                                original_filename[-4:].lower() == '.pdf'):
-                            signed_filename =\
-                                '%s_signed.pdf' % original_filename[:-4]
-                        else:
-                            signed_filename = original_filename
-                        if signed_filename in signed_filenames:
-                            logger.debug(
-                                'File %s is already attached as '
-                                'signed_attachment_ids', signed_filename)
-                            continue
-                        attach = self.env['ir.attachment'].create({
-                            'name': signed_filename,
-                            'res_id': res_id,
-                            'res_model': res_model,
-                            'datas': dl.content,
-                            'datas_fname': signed_filename,
-                            })
-                        req.signed_attachment_ids = [(4, attach.id)]
-                        signed_filenames.append(signed_filename)
-                        logger.info(
-                            'Signed file %s attached on %s ID %d',
-                            signed_filename, res_model, res_id)
-            if len(signed_filenames) == docs_to_sign_count:
-                req.state = 'archived'
+                        'File %s is already attached as '
+                        'signed_attachment_ids', signed_filename)
+                    continue
+                signed_filenames.append(signed_filename)
+                to_download.append((req, file_id, signed_filename))
+
+        tracing.phase('download')
+        sources = reqs.get_source_objects()
+        tmp_dir = self.env['ir.attachment']._full_path('')
+        if not os.path.isdir(tmp_dir):
+            os.makedirs(tmp_dir)
+        byte_budget = ByteBudget(self.yousign_download_max_bytes())
+        graph = TaskGraph(max_workers=max_workers)
+        for req, file_id, signed_filename in to_download:
+            graph.add((req.id, file_id), partial(
+                capture_errors, download_to_tempfile, client,
+                file_id + '/download', tmp_dir, retry=retry,
+                byte_budget=byte_budget))
+        dl_results = graph.run()
+
+        tracing.phase('attach')
+        try:
+            for req, file_id, signed_filename in to_download:
+                dl, error = dl_results.pop((req.id, file_id))
+                if error:
+                    req._archive_failure(
+                        error, raise_if_ko,
+                        "Skipping Yousign request %s ID %s due to download "
+                        "failure")
+                    continue
+                src_obj = sources[req.id]
+                if src_obj:
+                    res_model = src_obj._name
+                    res_id = src_obj.id
+                else:
+                    res_model = self._name
+                    res_id = req.id
+                tmp_path, file_size, checksum = dl
+                attach = self.store_signed_file(
+                    tmp_path, file_size, checksum, {
+                        'name': signed_filename,
+                        'res_id': res_id,
+                        'res_model': res_model,
+                        'datas_fname': signed_filename,
+                        })
+                req.signed_attachment_ids = [(4, attach.id)]
+                new_signed[req] += 1
+                logger.info(
+                    'Signed file %s attached on %s ID %d',
+                    signed_filename, res_model, res_id)
+        finally:
+            # remove the temporary files that were not used
+            for dl, error in dl_results.values():
+                if dl and os.path.exists(dl[0]):
+                    os.remove(dl[0])
+
+        for req, new_count in new_signed.items():
+            docs_to_sign_count = len(req.attachment_ids)
+            signed_count = len(req.signed_attachment_ids)
+            if signed_count == docs_to_sign_count:
+                req.write({'state': 'archived', 'next_check_at': False})
                 req.message_post(_(
                     "%d signed document(s) are now attached. "
                     "Request %s is archived")
-                    % (len(signed_filenames), req.name))
+                    % (signed_count, req.name))
+            elif docs_to_sign_count:
+                req.write(req._prepare_next_check(changed=bool(new_count)))
 
         return
 
@@ -814,6 +1998,11 @@ class YousignRequestSignatory(models.Model):
     comment = fields.Text(string='Comment')
     signature_date = fields.Date(string='Signature Date', readonly=True)
 
+    def init(self, cr):
+        create_index(
+            cr, 'yousign_request_signatory_parent_state_index', self._table,
+            'parent_id, state')
+
     def create(self, cr, uid, vals, context=None):
         vals_reformated = self._generic_reformat_phonenumbers(
             cr, uid, None, vals, context=context)
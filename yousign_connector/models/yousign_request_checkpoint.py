@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from openerp import api, fields, models
+import hashlib
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CheckpointWriter(object):
+    '''Checkpoints of one call of send(). save() only keeps them in
+    memory: flush() writes them with one separate cursor and one commit,
+    at the end of each phase of send(), so that sending a request with
+    many objects doesn't use one database connection per object.
+    If the process dies before the flush, the objects created on Yousign
+    are not in the checkpoints: the next call of send() sees them on the
+    procedure and starts over (cf yousign.request._send_load_checkpoints).'''
+
+    def __init__(self, model, request_id):
+        self.model = model
+        self.request_id = request_id
+        self.pending = {}
+
+    def save(self, key, ys_identifier, fingerprint):
+        self.pending[self.model.key_to_str(key)] = (
+            ys_identifier, fingerprint)
+
+    def flush(self):
+        '''Committed right away, in a separate transaction'''
+        if not self.pending:
+            return
+        key_strs = tuple(self.pending.keys())
+        uid = self.model._uid
+        with self.model.pool.cursor() as cr:
+            cr.execute(
+                "DELETE FROM yousign_request_checkpoint "
+                "WHERE request_id=%s AND key IN %s",
+                (self.request_id, key_strs))
+            values = []
+            for key_str, (ys_identifier, fingerprint) in \
+                    self.pending.items():
+                values += [
+                    self.request_id, key_str, ys_identifier, fingerprint,
+                    uid, uid]
+            cr.execute(
+                "INSERT INTO yousign_request_checkpoint "
+                "(request_id, key, ys_identifier, fingerprint, create_uid, "
+                "create_date, write_uid, write_date) VALUES " +
+                ", ".join([
+                    "(%s, %s, %s, %s, %s, now() at time zone 'UTC', %s, "
+                    "now() at time zone 'UTC')"] * len(self.pending)),
+                values)
+        logger.debug(
+            '%d checkpoints saved for Yousign request ID %d',
+            len(key_strs), self.request_id)
+        self.pending = {}
+
+    def clear(self):
+        '''Committed right away, in a separate transaction'''
+        self.pending = {}
+        with self.model.pool.cursor() as cr:
+            cr.execute(
+                "DELETE FROM yousign_request_checkpoint WHERE request_id=%s",
+                (self.request_id, ))
+
+
+class YousignRequestCheckpoint(models.Model):
+    '''Objects already created on Yousign by send(). They are written
+    with a separate cursor (cf CheckpointWriter), so they are kept when
+    the transaction of send() is rolled back, and a new call of send()
+    continues from there.
+    request_id is not a many2one on purpose: a foreign key would need a
+    lock on the Yousign request, which is locked by the transaction of
+    send().'''
+    _name = 'yousign.request.checkpoint'
+    _description = 'Checkpoints of the sending of Yousign requests'
+    _rec_name = 'key'
+
+    request_id = fields.Integer(
+        string='Yousign Request ID', required=True, readonly=True,
+        select=True)
+    # 'procedure', 'file,<attach ID>', 'member,<signatory ID>',
+    # 'file_object,<signatory ID>,<attach ID>'
+    key = fields.Char(required=True, readonly=True)
+    ys_identifier = fields.Char(
+        string='Yousign ID', required=True, readonly=True)
+    fingerprint = fields.Char(
+        readonly=True, help="SHA1 of the data sent to Yousign")
+
+    _sql_constraints = [(
+        'request_key_uniq',
+        'unique(request_id, key)',
+        'This checkpoint already exists!')]
+
+    @api.model
+    def fingerprint_of(self, value):
+        return hashlib.sha1(json.dumps(value, sort_keys=True)).hexdigest()
+
+    @api.model
+    def key_to_str(self, key):
+        return ','.join([str(x) for x in key])
+
+    @api.model
+    def load(self, request_id):
+        '''Returns a dict with key = checkpoint key (tuple),
+        value = (ys_identifier, fingerprint)'''
+        self._cr.execute(
+            "SELECT key, ys_identifier, fingerprint "
+            "FROM yousign_request_checkpoint WHERE request_id=%s",
+            (request_id, ))
+        res = {}
+        for key_str, ys_identifier, fingerprint in self._cr.fetchall():
+            key = tuple([
+                x.isdigit() and int(x) or x for x in key_str.split(',')])
+            res[key] = (ys_identifier, fingerprint)
+        return res
+
+    @api.model
+    def writer(self, request_id):
+        return CheckpointWriter(self, request_id)
+
+    @api.model
+    def purge(self):
+        '''Remove the checkpoints of the requests that are not being
+        sent any more'''
+        self._cr.execute(
+            "DELETE FROM yousign_request_checkpoint c WHERE NOT EXISTS ("
+            "SELECT 1 FROM yousign_request r WHERE r.id = c.request_id "
+            "AND r.state IN ('draft', 'sending'))")
+        logger.info(
+            'Yousign purge: %d send checkpoints deleted', self._cr.rowcount)
@@ -2,11 +2,31 @@
 # © 2018 Akretion (Alexis de Lattre <alexis.delattre@akretion.com>)
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from openerp import api, fields, models, _
+from openerp import api, fields, models, tools, _
 from openerp.exceptions import Warning as UserError, ValidationError
+from openerp.addons.email_template.email_template import mako_template_env,\
+    format_tz
+import threading
 import logging
 logger = logging.getLogger(__name__)
 
+# Compiled mako templates of the dynamic fields, per Odoo worker
+# key = (model, id, field name, lang), value = (source, compiled template)
+COMPILED_TEMPLATES_MAX = 1000
+_compiled_templates = {}
+_compiled_templates_lock = threading.Lock()
+
+
+def clear_compiled_templates(model=None, ids=None):
+    with _compiled_templates_lock:
+        if model is None:
+            _compiled_templates.clear()
+            return
+        ids = set(ids or [])
+        for key in _compiled_templates.keys():
+            if key[0] == model and key[1] in ids:
+                del _compiled_templates[key]
+
 
 class YousignRequestTemplate(models.Model):
     _name = 'yousign.request.template'
@@ -53,6 +73,13 @@ class YousignRequestTemplate(models.Model):
     ir_value_id = fields.Many2one(
         'ir.values', string='Sidebar Button', readonly=True, copy=False,
         help="Sidebar button to open the sidebar action")
+    bulk_act_window_id = fields.Many2one(
+        'ir.actions.act_window', string='Bulk Sidebar Action', readonly=True,
+        copy=False, help="Sidebar action to create and send Yousign "
+        "requests on several records of the related document model")
+    bulk_ir_value_id = fields.Many2one(
+        'ir.values', string='Bulk Sidebar Button', readonly=True, copy=False,
+        help="Sidebar button to open the bulk sidebar action")
 
     _sql_constraints = [
         (
@@ -89,11 +116,46 @@ class YousignRequestTemplate(models.Model):
                 'key2': 'client_action_multi',
                 'value': "ir.actions.act_window,%d" % action.id,
                 })
-
             template.write({
                 'ir_act_window_id': action.id,
                 'ir_value_id': ir_value.id,
                 })
+        self.create_bulk_button()
+        return
+
+    @api.multi
+    def create_bulk_button(self):
+        '''Add the bulk wizard to the Action menu of the related model.
+        Also called by the migration for the templates whose button was
+        created before the bulk wizard existed.'''
+        iaao = self.env['ir.actions.act_window']
+        ivo = self.env['ir.values']
+        bulk_view = self.env.ref('yousign_connector.yousign_request_bulk_form')
+        for template in self:
+            if template.bulk_act_window_id:
+                continue
+            src_obj = template.model_id.model
+            bulk_button_name = _('Send Yousign Requests (%s)') % template.name
+            bulk_action = iaao.sudo().create({
+                'name': bulk_button_name,
+                'type': 'ir.actions.act_window',
+                'res_model': 'yousign.request.bulk',
+                'src_model': src_obj,
+                'view_mode': 'form',
+                'view_id': bulk_view.id,
+                'target': 'new',
+                'context': "{'yousign_template_id': %d}" % template.id,
+                })
+            bulk_ir_value = ivo.sudo().create({
+                'name': bulk_button_name,
+                'model': src_obj,
+                'key2': 'client_action_multi',
+                'value': "ir.actions.act_window,%d" % bulk_action.id,
+                })
+            template.write({
+                'bulk_act_window_id': bulk_action.id,
+                'bulk_ir_value_id': bulk_ir_value.id,
+                })
         return
 
     @api.multi
@@ -103,6 +165,10 @@ class YousignRequestTemplate(models.Model):
                 template.ir_act_window_id.sudo().unlink()
             if template.ir_value_id:
                 template.ir_value_id.sudo().unlink()
+            if template.bulk_act_window_id:
+                template.bulk_act_window_id.sudo().unlink()
+            if template.bulk_ir_value_id:
+                template.bulk_ir_value_id.sudo().unlink()
         return
 
     @api.multi
@@ -116,6 +182,99 @@ class YousignRequestTemplate(models.Model):
             }
         return res
 
+    @api.model
+    def create(self, vals):
+        self.clear_caches()
+        return super(YousignRequestTemplate, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        clear_compiled_templates(self._name, self.ids)
+        return super(YousignRequestTemplate, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        clear_compiled_templates(self._name, self.ids)
+        return super(YousignRequestTemplate, self).unlink()
+
+    @tools.ormcache(skiparg=2)
+    def _get_template_id(self, cr, uid, model, xmlid, company_id):
+        '''Cached resolution of the template, by XMLID or else by model.
+        The company is only in the arguments because it is part of the key
+        of the cache (multi-company record rule).
+        The cache is cleared by create(), write() and unlink().'''
+        if xmlid:
+            try:
+                res_model, res_id = self.pool['ir.model.data']\
+                    .xmlid_to_res_model_res_id(
+                        cr, uid, xmlid, raise_if_not_found=True)
+                if (
+                        res_model == self._name and
+                        self.exists(cr, uid, [res_id])):
+                    return res_id
+            except Exception:
+                pass
+        ids = self.search(cr, uid, [('model', '=', model)], limit=1)
+        return ids and ids[0] or False
+
+    @api.model
+    def get_compiled_template(self, record, field_name):
+        '''Returns the compiled mako template of a field of the record, in
+        the language of the context of the record. The cache entry is only
+        used when the source of the template is the same, so a template
+        modified by another Odoo worker is compiled again.'''
+        source = tools.ustr(record[field_name])
+        key = (
+            record._name, record.id, field_name, record._context.get('lang'))
+        cached = _compiled_templates.get(key)
+        if cached and cached[0] == source:
+            return cached[1]
+        compiled = mako_template_env.from_string(source)
+        with _compiled_templates_lock:
+            if len(_compiled_templates) >= COMPILED_TEMPLATES_MAX:
+                _compiled_templates.clear()
+            _compiled_templates[key] = (source, compiled)
+        return compiled
+
+    @api.model
+    def render_template_batch(self, record, field_name, model, res_ids):
+        '''Same as render_template_batch() of email.template, but the
+        template is given as a field of a record and the compiled
+        template is cached'''
+        res_ids = filter(None, res_ids)
+        results = dict.fromkeys(res_ids, u"")
+        try:
+            template = self.get_compiled_template(record, field_name)
+        except Exception:
+            logger.exception(
+                "Failed to load template of field %s of %s",
+                field_name, record)
+            return results
+        context = self._context
+        cr, uid = self._cr, self._uid
+        variables = {
+            'format_tz':
+            lambda dt, tz=False, format=False, context=context:
+            format_tz(self.pool, cr, uid, dt, tz, format, context),
+            'user': self.env.user,
+            'ctx': context,
+            }
+        for obj in self.env[model].browse(res_ids) or [None]:
+            variables['object'] = obj
+            try:
+                render_result = template.render(variables)
+            except Exception:
+                logger.exception(
+                    "Failed to render template of field %s of %s "
+                    "using values %r", field_name, record, variables)
+                render_result = u""
+            if render_result == u"False":
+                render_result = u""
+            results[obj and obj.id or None] = render_result
+        return results
+
 
 class YousignRequestTemplateSignatory(models.Model):
     _name = 'yousign.request.template.signatory'
@@ -161,36 +320,57 @@ class YousignRequestTemplateSignatory(models.Model):
                     "Dynamic Partner is required when Partner Type is set "
                     "to 'Dynamic'"))
 
+    @api.multi
+    def write(self, vals):
+        clear_compiled_templates(self._name, self.ids)
+        return super(YousignRequestTemplateSignatory, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        clear_compiled_templates(self._name, self.ids)
+        return super(YousignRequestTemplateSignatory, self).unlink()
+
     @api.multi
     def prepare_template2request(self, model, res_id):
         self.ensure_one()
-        eto = self.env['email.template']
+        return self.prepare_template2request_batch(model, [res_id])[res_id]
+
+    @api.multi
+    def prepare_template2request_batch(self, model, res_ids):
+        '''Returns a dict with key = res_id, value = signatory vals'''
+        self.ensure_one()
+        yrto = self.env['yousign.request.template']
         if self.partner_type == 'static':
-            partner = self.partner_id
+            partners = dict.fromkeys(res_ids, self.partner_id)
         elif self.partner_type == 'dynamic':
-            dynamic_partner_str = eto.render_template_batch(
-                self.partner_tmpl, model, [res_id])[res_id]
-            dynamic_partner_id = int(dynamic_partner_str)
-            partner = self.env['res.partner'].browse(dynamic_partner_id)
+            dynamic_partner_strs = yrto.render_template_batch(
+                self, 'partner_tmpl', model, res_ids)
+            partners = dict([
+                (res_id, self.env['res.partner'].browse(int(partner_str)))
+                for (res_id, partner_str) in dynamic_partner_strs.items()])
         else:
             raise UserError(_('Unsupported partner type'))
-        vals = {
-            'partner_id': partner.id,
-            'email': partner.email,
-            'lastname': partner.name,
-            'mobile': partner.mobile,
-            'auth_mode': self.auth_mode,
-            'mention_top': self.mention_top,
-            'mention_bottom': self.mention_bottom,
-        }
-        if (
-                hasattr(partner, 'firstname') and
-                not partner.is_company):
-            vals.update({
-                'firstname': partner.firstname,
-                'lastname': partner.lastname,
-                })
-        return vals
+        res = {}
+        for res_id in res_ids:
+            partner = partners[res_id]
+            vals = {
+                'partner_id': partner.id,
+                'email': partner.email,
+                'lastname': partner.name,
+                'mobile': partner.mobile,
+                'auth_mode': self.auth_mode,
+                'mention_top': self.mention_top,
+                'mention_bottom': self.mention_bottom,
+            }
+            if (
+                    hasattr(partner, 'firstname') and
+                    not partner.is_company):
+                vals.update({
+                    'firstname': partner.firstname,
+                    'lastname': partner.lastname,
+                    })
+            res[res_id] = vals
+        return res
 
 
 class YousignRequestTemplateNotification(models.Model):
@@ -231,18 +411,38 @@ class YousignRequestTemplateNotification(models.Model):
                 raise ValidationError(_(
                     "You must select who should be notified."))
 
+    @api.multi
+    def write(self, vals):
+        clear_compiled_templates(self._name, self.ids)
+        return super(YousignRequestTemplateNotification, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        clear_compiled_templates(self._name, self.ids)
+        return super(YousignRequestTemplateNotification, self).unlink()
+
     @api.multi
     def prepare_template2request(self, model, res_id):
         self.ensure_one()
-        eto = self.env['email.template']
-        vals = {
-            'notif_type': self.notif_type,
-            'creator': self.creator,
-            'members': self.members,
-            'subscribers': self.subscribers,
-            'partner_ids': [(6, 0, self.partner_ids.ids)],
-            }
+        return self.prepare_template2request_batch(model, [res_id])[res_id]
+
+    @api.multi
+    def prepare_template2request_batch(self, model, res_ids):
+        '''Returns a dict with key = res_id, value = notification vals'''
+        self.ensure_one()
+        yrto = self.env['yousign.request.template']
+        res = {}
+        for res_id in res_ids:
+            res[res_id] = {
+                'notif_type': self.notif_type,
+                'creator': self.creator,
+                'members': self.members,
+                'subscribers': self.subscribers,
+                'partner_ids': [(6, 0, self.partner_ids.ids)],
+                }
         for dyn_field in ['subject', 'body']:
-            vals[dyn_field] = eto.render_template_batch(
-                self[dyn_field], model, [res_id])[res_id]
-        return vals
+            rendered = yrto.render_template_batch(
+                self, dyn_field, model, res_ids)
+            for res_id in res_ids:
+                res[res_id][dyn_field] = rendered[res_id]
+        return res
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import PyPDF2
+except ImportError:
+    logger.debug('Cannot import PyPDF2')
+
+
+def _get(node, key, default=None):
+    # dict.get() doesn't resolve the indirect objects of PyPDF2
+    if key in node:
+        return node[key]
+    return default
+
+
+def inspect_pdf(fileobj):
+    '''Read only the xref table, the trailer and the branch of the page
+    tree that leads to the last page, instead of loading all the pages
+    like PdfFileReader.getNumPages() does.
+    Returns a dict with the keys num_pages, last_page_mediabox
+    ('llx,lly,urx,ury'), encrypted, valid and error.'''
+    res = {
+        'num_pages': 0,
+        'last_page_mediabox': False,
+        'encrypted': False,
+        'valid': False,
+        'error': False,
+        }
+    try:
+        reader = PyPDF2.PdfFileReader(fileobj, strict=False)
+        if reader.isEncrypted:
+            res.update({
+                'encrypted': True,
+                'error': 'The PDF file is encrypted',
+                })
+            return res
+        pages = reader.trailer['/Root']['/Pages']
+        count = _get(pages, '/Count')
+        if count is None:
+            num_pages = reader.getNumPages()
+        else:
+            num_pages = int(count)
+        node = pages
+        # /MediaBox is inheritable
+        mediabox = _get(node, '/MediaBox')
+        while _get(node, '/Type') != '/Page' and _get(node, '/Kids'):
+            node = node['/Kids'][-1].getObject()
+            mediabox = _get(node, '/MediaBox', mediabox)
+        if mediabox:
+            res['last_page_mediabox'] = ','.join(
+                ['%g' % float(x) for x in mediabox])
+        res.update({
+            'num_pages': num_pages,
+            'valid': num_pages > 0,
+            'error': num_pages <= 0 and 'The PDF file has no pages' or False,
+            })
+    except Exception as e:
+        logger.info('Failed to read PDF file: %s', e)
+        res['error'] = str(e).decode('utf-8', 'replace')
+    return res
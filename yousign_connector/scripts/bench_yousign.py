@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+'''End-to-end benchmark of the Yousign connector: creates N Yousign
+requests via XML-RPC, then measures send(), update_status() and
+archive() on each of them.
+
+Usage: python bench_yousign.py -d DBNAME -p ADMIN_PASSWORD
+    [--url http://127.0.0.1:8069] [-n 100] [-c 4] [--start-fake-server]
+
+The Odoo server must run with the module yousign_connector installed
+on a test database, and with these keys in its config file:
+    yousign_url = http://127.0.0.1:8089
+    yousign_apikey = fake
+so that it uses the stand-in server fake_yousign_server.py. With
+--start-fake-server, this script starts the stand-in server itself on
+the port --fake-port (the options --latency, --error-rate, --rate-429
+are given to it). The requests created by the benchmark are not
+deleted: use a throwaway database.
+
+For each phase, the script prints the throughput and the p50/p99
+latency of the XML-RPC calls, one call per Yousign request, with -c
+calls in parallel. The exit code is 1 if a phase has errors, a p99
+above --max-p99 seconds or a throughput below --min-throughput
+requests per second.'''
+
+import argparse
+import base64
+import os
+import sys
+import threading
+import time
+import xmlrpclib
+
+# Smallest valid PDF with one A4 page
+PDF = (
+    '%PDF-1.4\n'
+    '1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n'
+    '2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n'
+    '3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\n'
+    'trailer<</Root 1 0 R>>\n'
+    '%%EOF\n')
+
+
+class Odoo(object):
+
+    def __init__(self, url, db, login, password):
+        self.url = url
+        self.db = db
+        self.password = password
+        common = xmlrpclib.ServerProxy('%s/xmlrpc/2/common' % url)
+        self.uid = common.authenticate(db, login, password, {})
+        if not self.uid:
+            raise SystemExit('Authentication failed')
+        self.local = threading.local()
+
+    def execute(self, model, method, *args):
+        # one connection per thread
+        proxy = getattr(self.local, 'proxy', None)
+        if proxy is None:
+            proxy = self.local.proxy = xmlrpclib.ServerProxy(
+                '%s/xmlrpc/2/object' % self.url, allow_none=True)
+        try:
+            return proxy.execute_kw(
+                self.db, self.uid, self.password, model, method, list(args))
+        except xmlrpclib.Fault as e:
+            # send(), update_status() and archive() return None, which the
+            # XML-RPC layer of Odoo 8 can't marshal: the call succeeded
+            if 'cannot marshal None' in e.faultString:
+                return None
+            raise
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * len(values))))
+    return values[index]
+
+
+def run_phase(name, odoo, method, ids, concurrency):
+    '''Call method on each request, with concurrency threads'''
+    durations = []
+    errors = []
+    queue = list(ids)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                req_id = queue.pop(0)
+            start = time.time()
+            try:
+                odoo.execute('yousign.request', method, [req_id])
+                with lock:
+                    durations.append(time.time() - start)
+            except Exception as e:
+                with lock:
+                    errors.append((req_id, e))
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.time() - start
+    throughput = len(durations) / total
+    p99 = percentile(durations, 99)
+    print('%-14s %5d requests in %7.2f s: %7.2f req/s, p50 %6.3f s, '
+          'p99 %6.3f s, %d errors' % (
+              name, len(ids), total, throughput,
+              percentile(durations, 50), p99, len(errors)))
+    for req_id, error in errors[:5]:
+        print('    request ID %d: %s' % (req_id, error))
+    return {'throughput': throughput, 'p99': p99, 'errors': len(errors)}
+
+
+def check_thresholds(name, stats, max_p99, min_throughput):
+    '''Returns the list of the thresholds exceeded by the phase'''
+    res = []
+    if stats['errors']:
+        res.append('%s: %d errors' % (name, stats['errors']))
+    if max_p99 and stats['p99'] > max_p99:
+        res.append('%s: p99 %.3f s > %.3f s' % (
+            name, stats['p99'], max_p99))
+    if min_throughput and stats['throughput'] < min_throughput:
+        res.append('%s: %.2f req/s < %.2f req/s' % (
+            name, stats['throughput'], min_throughput))
+    return res
+
+
+def create_requests(odoo, count):
+    attach_id = odoo.execute('ir.attachment', 'create', {
+        'name': 'bench.pdf',
+        'datas_fname': 'bench.pdf',
+        'res_model': 'yousign.request',
+        'datas': base64.b64encode(PDF),
+        })
+    ids = []
+    start = time.time()
+    for i in range(count):
+        ids.append(odoo.execute('yousign.request', 'create', {
+            'init_mail_subject': 'Benchmark %d' % i,
+            'init_mail_body':
+            '<p>Please sign: {yousignUrl|Access to documents}</p>',
+            'attachment_ids': [(6, 0, [attach_id])],
+            'signatory_ids': [(0, 0, {
+                'firstname': 'Bench',
+                'lastname': 'Signatory %d' % i,
+                'email': 'bench%d@example.com' % i,
+                'auth_mode': 'email',
+                })],
+            }))
+    print('%-14s %5d requests in %7.2f s' % (
+        'create', count, time.time() - start))
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8069')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('-u', '--login', default='admin')
+    parser.add_argument('-p', '--password', required=True)
+    parser.add_argument(
+        '-n', '--requests', type=int, default=100,
+        help="Number of Yousign requests (default: 100)")
+    parser.add_argument(
+        '-c', '--concurrency', type=int, default=4,
+        help="Number of XML-RPC calls in parallel (default: 4)")
+    parser.add_argument('--start-fake-server', action='store_true')
+    parser.add_argument('--fake-port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument(
+        '--max-p99', type=float, default=10.0,
+        help="Max p99 latency of a phase in seconds, 0 to disable "
+        "(default: 10)")
+    parser.add_argument(
+        '--min-throughput', type=float, default=1.0,
+        help="Min throughput of a phase in requests per second, 0 to "
+        "disable (default: 1)")
+    args = parser.parse_args()
+    if args.start_fake_server:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import fake_yousign_server
+        fake_yousign_server.make_server(
+            args.fake_port, latency=args.latency,
+            error_rate=args.error_rate, rate_429=args.rate_429)
+    odoo = Odoo(args.url, args.database, args.login, args.password)
+    ids = create_requests(odoo, args.requests)
+    failures = []
+    for method in ('send', 'update_status', 'archive'):
+        stats = run_phase(method, odoo, method, ids, args.concurrency)
+        failures += check_thresholds(
+            method, stats, args.max_p99, args.min_throughput)
+    states = {}
+    for req in odoo.execute(
+            'yousign.request', 'read', ids, ['state']):
+        states[req['state']] = states.get(req['state'], 0) + 1
+    print('Final states: %s' % ', '.join([
+        '%s=%d' % item for item in sorted(states.items())]))
+    for failure in failures:
+        print('FAIL %s' % failure)
+    return failures and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
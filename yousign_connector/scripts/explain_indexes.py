@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+'''Check that the hot queries on the Yousign requests use the indexes
+created by the init() of the models.
+
+Usage: python explain_indexes.py -d DBNAME [-n 200000]
+
+The database must have the module yousign_connector installed. The
+script inserts a synthetic dataset in a transaction, runs ANALYZE and
+EXPLAIN on each query and checks that the plan uses the expected index.
+The transaction is rolled back at the end and the tables are analyzed
+again, so the database is left as it was. It also checks that the
+single-column indexes covered by these indexes were dropped. The exit
+code is 1 if a plan doesn't use the expected index or if a redundant
+index is still there.'''
+
+import argparse
+import sys
+import time
+import psycopg2
+
+SEED_REQUESTS = """
+    INSERT INTO yousign_request (
+        name, state, company_id, model, res_id, ys_identifier,
+        next_check_at, remind_interval, remind_limit,
+        create_date, write_date)
+    SELECT
+        'BENCH' || i,
+        CASE
+            WHEN i %% 100 < 3 THEN 'sent'
+            WHEN i %% 100 < 4 THEN 'signed'
+            WHEN i %% 100 < 6 THEN 'draft'
+            WHEN i %% 100 < 8 THEN 'cancel'
+            ELSE 'archived' END,
+        (SELECT min(id) FROM res_company),
+        CASE i %% 3
+            WHEN 0 THEN 'sale.order'
+            WHEN 1 THEN 'res.partner'
+            ELSE 'account.invoice' END,
+        i %% 1000 + 1,
+        CASE WHEN i %% 10 = 0 THEN md5(i::text)
+            ELSE '/procedures/' || md5(i::text) END,
+        CASE WHEN i %% 100 < 4
+            THEN now() at time zone 'UTC' + (i %% 96 - 24) * interval '1 hour'
+            ELSE NULL END,
+        3, 10,
+        now() at time zone 'UTC', now() at time zone 'UTC'
+    FROM generate_series(1, %s) AS i
+    """
+
+SEED_SIGNATORIES = """
+    INSERT INTO yousign_request_signatory (
+        parent_id, sequence, lastname, auth_mode, state)
+    SELECT r.id, s, 'Bench', 'sms',
+        CASE r.state
+            WHEN 'sent' THEN 'pending'
+            WHEN 'draft' THEN 'draft'
+            WHEN 'cancel' THEN 'draft'
+            ELSE 'signed' END
+    FROM yousign_request r, generate_series(1, 2) AS s
+    WHERE r.name LIKE 'BENCH%'
+    """
+
+# (description, query, expected index)
+# The queries are executed without parameters, so '%' is not escaped
+QUERIES = [
+    (
+        'cron_update() claim of the sent requests',
+        """SELECT id FROM yousign_request
+        WHERE state='sent' AND ys_identifier LIKE '/procedures/%'
+        AND next_check_at <= now() at time zone 'UTC'
+        AND id > 0 AND id % 1 = 0
+        AND (last_update IS NULL OR last_update < now() at time zone 'UTC')
+        ORDER BY id LIMIT 50 FOR UPDATE SKIP LOCKED""",
+        'yousign_request_cron_index'),
+    (
+        'cron_update() claim of the signed requests',
+        """SELECT id FROM yousign_request
+        WHERE state='signed' AND ys_identifier LIKE '/procedures/%'
+        AND next_check_at <= now() at time zone 'UTC'
+        AND id > 0 AND id % 1 = 0
+        ORDER BY id LIMIT 50 FOR UPDATE SKIP LOCKED""",
+        'yousign_request_cron_index'),
+    (
+        'list view filtered on state and company',
+        """SELECT id FROM yousign_request
+        WHERE state='sent'
+        AND company_id=(SELECT min(id) FROM res_company)
+        ORDER BY id DESC LIMIT 80""",
+        'yousign_request_state_company_index'),
+    (
+        'requests of a source record',
+        """SELECT id FROM yousign_request
+        WHERE model='sale.order' AND res_id=42""",
+        'yousign_request_model_res_id_index'),
+    (
+        'pending signatories of a request',
+        """SELECT id FROM yousign_request_signatory
+        WHERE parent_id=(SELECT max(id) FROM yousign_request)
+        AND state='pending'""",
+        'yousign_request_signatory_parent_state_index'),
+    ]
+
+# covered by yousign_request_cron_index and
+# yousign_request_model_res_id_index (dropped by init())
+REDUNDANT_INDEXES = [
+    'yousign_request_next_check_at_index',
+    'yousign_request_model_index',
+    'yousign_request_res_id_index',
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--host')
+    parser.add_argument('--port')
+    parser.add_argument('-U', '--user')
+    parser.add_argument('-W', '--password')
+    parser.add_argument(
+        '-n', '--requests', type=int, default=200000,
+        help="Number of synthetic Yousign requests (default: 200000)")
+    args = parser.parse_args()
+    conn = psycopg2.connect(
+        database=args.database, host=args.host, port=args.port,
+        user=args.user, password=args.password)
+    failures = 0
+    try:
+        cr = conn.cursor()
+        cr.execute(
+            "SELECT indexname FROM pg_indexes WHERE indexname IN %s",
+            (tuple(REDUNDANT_INDEXES), ))
+        for (index, ) in cr.fetchall():
+            failures += 1
+            print('[FAIL] redundant index %s still exists' % index)
+        start = time.time()
+        cr.execute(SEED_REQUESTS, (args.requests, ))
+        cr.execute(SEED_SIGNATORIES)
+        cr.execute('ANALYZE yousign_request')
+        cr.execute('ANALYZE yousign_request_signatory')
+        print('Seeded %d requests in %.1f seconds' % (
+            args.requests, time.time() - start))
+        for description, query, index in QUERIES:
+            cr.execute('EXPLAIN ' + query)
+            plan = '\n'.join([row[0] for row in cr.fetchall()])
+            ok = index in plan
+            if not ok:
+                failures += 1
+            print('\n[%s] %s (expected index: %s)\n%s' % (
+                ok and 'OK' or 'FAIL', description, index, plan))
+    finally:
+        conn.rollback()
+        # the statistics of the seeded rows survive the rollback
+        conn.autocommit = True
+        cr = conn.cursor()
+        cr.execute('ANALYZE yousign_request')
+        cr.execute('ANALYZE yousign_request_signatory')
+        conn.close()
+    print('\n%d failure(s) on %d plans and %d redundant indexes' % (
+        failures, len(QUERIES), len(REDUNDANT_INDEXES)))
+    return failures and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+'''Stand-in for the Yousign API, to measure the performance of the
+connector without network access (cf bench_yousign.py).
+
+Usage: python fake_yousign_server.py [--port 8089] [--latency 0.2]
+    [--error-rate 0.01] [--rate-429 0.05] [--sign-after 0]
+
+Then set yousign_url = http://127.0.0.1:8089 in the Odoo server config
+file (any yousign_apikey works).
+
+It implements the endpoints used by the connector: /procedures,
+/files, /files/<id>/download, /members, /members/<id>/reminders and
+/file_objects. Everything is kept in memory. The members of a started
+procedure sign after --sign-after seconds. --latency adds a random
+delay (exponential distribution of mean --latency seconds) to each
+request; --error-rate and --rate-429 are the probabilities to answer
+HTTP 500 and HTTP 429 (with a Retry-After header).'''
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+
+OPTIONS = None
+LOCK = threading.Lock()
+# key = Yousign ID ('/procedures/<uuid>'...), value = dict
+OBJECTS = {}
+
+
+def new_id(prefix):
+    return '/%s/%s' % (prefix, uuid.uuid4())
+
+
+def procedure_status(proc):
+    '''Update the members of the procedure when they sign'''
+    if proc['status'] == 'active' and (
+            time.time() - proc['started_at'] >= OPTIONS.sign_after):
+        for member_id in proc['members']:
+            OBJECTS[member_id]['status'] = 'done'
+        proc['status'] = 'finished'
+    return proc['status']
+
+
+def procedure_json(proc):
+    procedure_status(proc)
+    return {
+        'id': proc['id'],
+        'name': proc['name'],
+        'status': proc['status'],
+        'files': [
+            {'id': file_id, 'name': OBJECTS[file_id]['name']}
+            for file_id in proc['files']],
+        'members': [
+            member_json(OBJECTS[member_id])
+            for member_id in proc['members']],
+        }
+
+
+def member_json(member):
+    return {
+        'id': member['id'],
+        'status': member['status'],
+        'firstname': member['firstname'],
+        'lastname': member['lastname'],
+        }
+
+
+class FakeYousignHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if OPTIONS.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, status, data=None, headers=None):
+        body = data is not None and json.dumps(data) or ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, title, headers=None):
+        self.send_json(
+            status, {'title': title, 'detail': 'Fake Yousign server'},
+            headers=headers)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = length and self.rfile.read(length) or ''
+        return body and json.loads(body) or {}
+
+    def handle_one(self, method):
+        body = self.read_json()
+        if OPTIONS.latency:
+            time.sleep(random.expovariate(1.0 / OPTIONS.latency))
+        draw = random.random()
+        if draw < OPTIONS.rate_429:
+            return self.send_error_json(
+                429, 'Too Many Requests', {'Retry-After': '1'})
+        if draw < OPTIONS.rate_429 + OPTIONS.error_rate:
+            return self.send_error_json(500, 'Internal Server Error')
+        parts = self.path.split('?')[0].strip('/').split('/')
+        with LOCK:
+            handler = getattr(
+                self, '%s_%s' % (method.lower(), parts[0]), None)
+            if handler is None:
+                return self.send_error_json(404, 'Not Found')
+            return handler(parts, body)
+
+    def do_GET(self):
+        self.handle_one('GET')
+
+    def do_POST(self):
+        self.handle_one('POST')
+
+    def do_PUT(self):
+        self.handle_one('PUT')
+
+    def do_DELETE(self):
+        self.handle_one('DELETE')
+
+    def get_object(self, parts):
+        return OBJECTS.get('/%s/%s' % (parts[0], parts[1]))
+
+    def post_procedures(self, parts, body):
+        proc = {
+            'id': new_id('procedures'),
+            'name': body.get('name'),
+            'status': 'draft',
+            'files': [],
+            'members': [],
+            }
+        OBJECTS[proc['id']] = proc
+        self.send_json(201, procedure_json(proc))
+
+    def get_procedures(self, parts, body):
+        proc = len(parts) == 2 and self.get_object(parts)
+        if not proc:
+            return self.send_error_json(404, 'Procedure not found')
+        self.send_json(200, procedure_json(proc))
+
+    def put_procedures(self, parts, body):
+        proc = len(parts) == 2 and self.get_object(parts)
+        if not proc:
+            return self.send_error_json(404, 'Procedure not found')
+        if body.get('start') and proc['status'] == 'draft':
+            proc['status'] = 'active'
+            proc['started_at'] = time.time()
+        self.send_json(200, procedure_json(proc))
+
+    def delete_procedures(self, parts, body):
+        proc = len(parts) == 2 and self.get_object(parts)
+        if not proc:
+            return self.send_error_json(404, 'Procedure not found')
+        proc['status'] = 'deleted'
+        self.send_json(204)
+
+    def post_files(self, parts, body):
+        proc = OBJECTS.get(body.get('procedure'))
+        if not proc or not body.get('content'):
+            return self.send_error_json(400, 'Bad Request')
+        sfile = {
+            'id': new_id('files'),
+            'name': body.get('name'),
+            'content': body['content'],
+            }
+        OBJECTS[sfile['id']] = sfile
+        proc['files'].append(sfile['id'])
+        self.send_json(201, {'id': sfile['id'], 'name': sfile['name']})
+
+    def get_files(self, parts, body):
+        sfile = self.get_object(parts)
+        if not sfile or len(parts) != 3 or parts[2] != 'download':
+            return self.send_error_json(404, 'File not found')
+        # the real API also answers with the base64 content
+        content = sfile['content']
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Digest', 'SHA-256=%s' % base64.b64encode(
+            hashlib.sha256(content).digest()))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def post_members(self, parts, body):
+        if len(parts) == 3 and parts[2] == 'reminders':
+            if not self.get_object(parts):
+                return self.send_error_json(404, 'Member not found')
+            return self.send_json(201, {'id': new_id('reminders')})
+        proc = OBJECTS.get(body.get('procedure'))
+        if not proc:
+            return self.send_error_json(400, 'Bad Request')
+        member = {
+            'id': new_id('members'),
+            'status': 'pending',
+            'firstname': body.get('firstname'),
+            'lastname': body.get('lastname'),
+            }
+        OBJECTS[member['id']] = member
+        proc['members'].append(member['id'])
+        self.send_json(201, member_json(member))
+
+    def get_members(self, parts, body):
+        member = len(parts) == 2 and self.get_object(parts)
+        if not member:
+            return self.send_error_json(404, 'Member not found')
+        self.send_json(200, member_json(member))
+
+    def post_file_objects(self, parts, body):
+        if (
+                body.get('member') not in OBJECTS or
+                body.get('file') not in OBJECTS):
+            return self.send_error_json(400, 'Bad Request')
+        self.send_json(201, {'id': new_id('file_objects')})
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(port, **options):
+    '''Start the server in a thread; returns the server. options are
+    the same as the command line options.'''
+    global OPTIONS
+    OPTIONS = argparse.Namespace(
+        latency=0.0, error_rate=0.0, rate_429=0.0, sign_after=0.0,
+        verbose=False)
+    for key, value in options.items():
+        setattr(OPTIONS, key, value)
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeYousignHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help="Mean latency added to each request, in seconds")
+    parser.add_argument(
+        '--error-rate', type=float, default=0.0,
+        help="Probability to answer HTTP 500")
+    parser.add_argument(
+        '--rate-429', type=float, default=0.0,
+        help="Probability to answer HTTP 429")
+    parser.add_argument(
+        '--sign-after', type=float, default=0.0,
+        help="Delay after which the members of a started procedure sign, "
+        "in seconds")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    server = make_server(
+        args.port, latency=args.latency, error_rate=args.error_rate,
+        rate_429=args.rate_429, sign_after=args.sign_after,
+        verbose=args.verbose)
+    print('Fake Yousign server listening on http://127.0.0.1:%d'
+          % args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+'''Tracing of the operations of the connector (send, update_status,
+archive, default_get). An operation is split into phases; each phase
+records its duration, the number of requests to Yousign and the bytes
+sent and received. The trace is logged as one JSON line at the end of
+the operation. Enabled by the config key yousign_tracing (cf
+yousign.request.yousign_tracing()); when it is disabled, phase() only
+costs a thread-local lookup.
+
+The phases are marked from the thread of the operation. The requests
+to Yousign sent by the worker threads of a TaskGraph are counted in the
+trace of the thread that runs the TaskGraph.'''
+
+from functools import wraps
+import json
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+MAX_LOGGED_IDS = 20
+
+_local = threading.local()
+
+
+def current():
+    '''Returns the trace of the current thread, or None'''
+    return getattr(_local, 'trace', None)
+
+
+def activate(trace):
+    '''Set the trace of the current thread. Returns the previous one.'''
+    previous = getattr(_local, 'trace', None)
+    _local.trace = trace
+    return previous
+
+
+def phase(name):
+    '''End the current phase of the trace and start the phase name'''
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.phase(name)
+
+
+def record_call(bytes_sent=0, bytes_received=0):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.add(1, bytes_sent, bytes_received)
+
+
+def record_bytes(bytes_received):
+    '''For the streamed downloads, counted after the request'''
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.add(0, 0, bytes_received)
+
+
+def format_bytes(size):
+    for unit in ('B', 'kB', 'MB'):
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = 'GB'
+    return unit == 'B' and '%d B' % size or '%.1f %s' % (size, unit)
+
+
+class Trace(object):
+
+    def __init__(self, operation, record_ids=None):
+        self.operation = operation
+        self.record_ids = list(record_ids or [])
+        self.lock = threading.Lock()
+        # calls, bytes sent, bytes received
+        self.counters = [0, 0, 0]
+        # list of [name, start, duration, calls, sent, received]
+        self.phases = []
+        self.current = None
+        self.start = None
+        self.duration = None
+        self.error = None
+        self.previous = None
+
+    def add(self, calls, bytes_sent, bytes_received):
+        with self.lock:
+            self.counters[0] += calls
+            self.counters[1] += bytes_sent
+            self.counters[2] += bytes_received
+
+    def _close_phase(self, now):
+        if self.current is None:
+            return
+        name, start, counters = self.current
+        with self.lock:
+            delta = [x - y for (x, y) in zip(self.counters, counters)]
+        self.phases.append([name, start - self.start, now - start] + delta)
+        self.current = None
+
+    def phase(self, name):
+        now = time.time()
+        self._close_phase(now)
+        with self.lock:
+            counters = list(self.counters)
+        self.current = (name, now, counters)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.previous = activate(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        now = time.time()
+        self._close_phase(now)
+        self.duration = now - self.start
+        self.error = exc_type and exc_type.__name__ or None
+        activate(self.previous)
+        self.previous = None
+        logger.info(
+            'Yousign trace: %s', json.dumps(self.as_dict(), sort_keys=True))
+        return False
+
+    def merged_phases(self):
+        '''The phases of the same name (e.g. one per request in a loop)
+        are merged, in the order of their first start'''
+        res = []
+        by_name = {}
+        for name, start, duration, calls, sent, received in self.phases:
+            item = by_name.get(name)
+            if item is None:
+                item = by_name[name] = {
+                    'name': name,
+                    'start': round(start, 3),
+                    'count': 0,
+                    'duration': 0.0,
+                    'calls': 0,
+                    'bytes_sent': 0,
+                    'bytes_received': 0,
+                    }
+                res.append(item)
+            item['count'] += 1
+            item['duration'] += duration
+            item['calls'] += calls
+            item['bytes_sent'] += sent
+            item['bytes_received'] += received
+        for item in res:
+            item['duration'] = round(item['duration'], 3)
+        return res
+
+    def as_dict(self):
+        ids = self.record_ids
+        res = {
+            'operation': self.operation,
+            'ids': ids[:MAX_LOGGED_IDS],
+            'count': len(ids),
+            'duration': round(self.duration or 0, 3),
+            'calls': self.counters[0],
+            'bytes_sent': self.counters[1],
+            'bytes_received': self.counters[2],
+            'phases': self.merged_phases(),
+            }
+        if self.error:
+            res['error'] = self.error
+        return res
+
+    def timeline(self):
+        '''Compact text, e.g. "update_status 1.25s 2 calls 3.1 kB |
+        sources 0.00s | get x2 1.20s 2 calls 3.1 kB | sync x2 0.05s"'''
+        parts = [self._format(
+            self.operation, 1, self.duration or 0, self.counters[0],
+            self.counters[1] + self.counters[2])]
+        parts += [self._format(
+            item['name'], item['count'], item['duration'], item['calls'],
+            item['bytes_sent'] + item['bytes_received'])
+            for item in self.merged_phases()]
+        return ' | '.join(parts)
+
+    def _format(self, name, count, duration, calls, size):
+        res = name
+        if count > 1:
+            res += ' x%d' % count
+        res += ' %.2fs' % duration
+        if calls:
+            res += ' %d call%s' % (calls, calls > 1 and 's' or '')
+        if size:
+            res += ' %s' % format_bytes(size)
+        return res
+
+
+def traced(operation):
+    '''Decorator of the methods of yousign.request: the method runs in a
+    trace, when tracing is enabled. With yousign_tracing = store, the
+    timeline is also written on the requests (cf store_trace()).
+    The metrics of the operation are flushed at the end, so that the
+    metrics endpoint sees them from any process (cf metrics.py).'''
+    def decorator(method):
+        def run(self, *args, **kwargs):
+            mode = self.yousign_tracing()
+            if not mode:
+                return method(self, *args, **kwargs)
+            trace = Trace(operation, self.ids)
+            with trace:
+                res = method(self, *args, **kwargs)
+            if mode == 'store' and self.ids:
+                self.store_trace(trace)
+            return res
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return run(self, *args, **kwargs)
+            finally:
+                self.env['yousign.metric'].flush()
+        return wrapper
+    return decorator
@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from . import yousign_request_remind
+from . import yousign_request_bulk
+from . import yousign_request_preflight
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#  © 2020 Akretion France (www.akretion.com)
+#  @author Alexis de Lattre <alexis.delattre@akretion.com>
+#  License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+
+from openerp import models, fields, api, _
+import logging
+logger = logging.getLogger(__name__)
+
+
+class YousignRequestBulk(models.TransientModel):
+    _name = 'yousign.request.bulk'
+    _description = 'Create and send Yousign requests on several records'
+
+    @api.model
+    def _default_template(self):
+        model = self._context.get('active_model')
+        if not model:
+            return False
+        return self.env['yousign.request'].get_template_from_context(model)
+
+    @api.model
+    def _default_count(self):
+        return len(self._context.get('active_ids') or [])
+
+    template_id = fields.Many2one(
+        'yousign.request.template', string='Template', required=True,
+        default=_default_template)
+    count = fields.Integer(
+        string='Number of Records', readonly=True, default=_default_count)
+    send_now = fields.Boolean(string='Send to Yousign', default=True)
+    background = fields.Boolean(
+        string='Send in Background', default=True,
+        help="The requests will be sent to Yousign by a scheduled action, "
+        "so you don't have to wait. The report of the template is also "
+        "rendered by the scheduled action, even when the requests are not "
+        "sent.")
+
+    @api.multi
+    def run(self):
+        self.ensure_one()
+        yro = self.env['yousign.request']
+        model = self._context.get('active_model')
+        res_ids = self._context.get('active_ids')
+        assert model and res_ids, 'Missing active_model or active_ids'
+        # The reports are rendered by send() or, for the requests that are
+        # not sent now, by the sending cron, one request per transaction:
+        # rendering thousands of reports here would exceed the time limit
+        # of the HTTP request
+        vals_by_res_id = yro.prepare_from_template(
+            self.template_id, model, res_ids, defer_report=True)
+        reqs = yro.browse()
+        for res_id in res_ids:
+            reqs |= yro.create(vals_by_res_id[res_id])
+        logger.info('%d Yousign requests created on %s', len(reqs), model)
+        if self.send_now and self.background:
+            reqs.send_background()
+        elif self.send_now:
+            for req in reqs:
+                try:
+                    with self._cr.savepoint():
+                        req.send()
+                except Exception as e:
+                    logger.exception(
+                        'Failed to send Yousign request %s ID %d',
+                        req.name, req.id)
+                    req.message_post(_(
+                        "Failed to send the request to Yousign: %s") % e)
+        elif reqs.filtered('report_pending_id'):
+            yro._trigger_send_cron()
+        action = self.env.ref('yousign_connector.yousign_request_action')
+        action_dict = action.read()[0]
+        action_dict['domain'] = [('id', 'in', reqs.ids)]
+        return action_dict
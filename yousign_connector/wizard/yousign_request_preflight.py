@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#  © 2020 Akretion France (www.akretion.com)
+#  @author Alexis de Lattre <alexis.delattre@akretion.com>
+#  License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+
+from openerp import models, fields, api, _
+
+
+class YousignRequestPreflight(models.TransientModel):
+    _name = 'yousign.request.preflight'
+    _description = 'Check Yousign requests before sending them'
+
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done'),
+        ], default='draft', readonly=True)
+    summary = fields.Text(readonly=True)
+
+    @api.multi
+    def run(self):
+        self.ensure_one()
+        assert self.env.context.get('active_model') == 'yousign.request',\
+            'Source model must be yousign request'
+        assert self.env.context.get('active_ids'), 'No requests selected'
+        requests = self.env['yousign.request'].browse(
+            self.env.context['active_ids'])
+        res = requests.preflight_check()
+        ok_count = len([x for x in res.values() if not x])
+        lines = [_("%d/%d request(s) can be sent to Yousign.") % (
+            ok_count, len(requests))]
+        for req in requests:
+            if res.get(req.id):
+                lines.append(u'%s:\n%s' % (
+                    req.display_name,
+                    u'\n'.join([u'- %s' % x for x in res[req.id]])))
+        self.write({'state': 'done', 'summary': u'\n\n'.join(lines)})
+        action = self.env['ir.actions.act_window'].for_xml_id(
+            'yousign_connector', 'yousign_request_preflight_action')
+        action['res_id'] = self.id
+        return action
@@ -4,13 +4,19 @@
 #  License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 
-from openerp import models, api
+from openerp import models, fields, api, _
 
 
 class YousignRequestRemind(models.TransientModel):
     _name = 'yousign.request.remind'
     _description = 'Remind several Yousign requests'
 
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done'),
+        ], default='draft', readonly=True)
+    summary = fields.Text(readonly=True)
+
     @api.multi
     def run(self):
         self.ensure_one()
@@ -19,5 +25,15 @@ class YousignRequestRemind(models.TransientModel):
         assert self.env.context.get('active_ids'), 'No requests selected'
         requests = self.env['yousign.request'].browse(
             self.env.context['active_ids'])
-        requests.remind()
-        return
+        res = requests.remind()
+        ok_count = len([x for x in res.values() if not x])
+        lines = [_("Reminder sent for %d/%d request(s).") % (
+            ok_count, len(requests))]
+        for req in requests:
+            if res.get(req.id):
+                lines.append(u'%s: %s' % (req.display_name, res[req.id]))
+        self.write({'state': 'done', 'summary': u'\n\n'.join(lines)})
+        action = self.env['ir.actions.act_window'].for_xml_id(
+            'yousign_connector', 'yousign_request_remind_action')
+        action['res_id'] = self.id
+        return action